@@ -27,14 +27,9 @@ from netgen import Neuron, NetworkGenerator
 from params import *
 import time
 import importlib
-from collections import deque
-import threading
 
-eventsBuffer = deque(maxlen=500)
-
-def collect_spikes(sink_node):
-    while True:  # Check first element of list
-        eventsBuffer.extend(sink_node.get_events())
+sys.path.append("..")
+from helpers.concerto_classes import NeuroListener_Dynapse
 
 def main():
     # Setup Dynapse1
@@ -66,22 +61,20 @@ def main():
     graph, filter_node, sink_node = ut.create_neuron_select_graph(model, monitored_neurons)
     graph.start() # It needs to be started
 
-    # clear the buffer
-    sink_node.get_events()
-
     # select the neurons to monitor
     filter_node.set_neurons(monitored_neurons)
 
     api.reset_timestamp()
 
-    spike_thread = threading.Thread(target=collect_spikes, args=sink_node)
-    spike_thread.daemon = True
-    spike_thread.start()
+    # Batched reads into a bounded ring, ids are the positions in monitored_neurons; attach observers to it
+    listener = NeuroListener_Dynapse(sink_node, monitored_neurons=monitored_neurons)
+    listener.start_event_listener()
 
     from live_gui.sliderGui import run_threaded_gui
     run_threaded_gui(model)
 
-    print(eventsBuffer)
+    listener.stop_listener()
+    print(listener.reader_stats())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,146 @@
+"""
+Project: Concerto
+Description: Synthetic load benchmark of the NeuroListener -> OrchestraGenerator pipeline, no chip and no MIDI
+            device needed. Poisson (optionally bursty) spike trains are replayed in real time into a generator
+            writing to a null (or recording) MIDI sink; each configuration reports sustained throughput, drop and
+            coalesce rates, p50/p99 pending latency (spike accepted -> picked for sending) and CPU load.
+
+            Run from the repository root:
+                python -m benchmarks.bench_pipeline --rates 1000 10000 100000 --duration 2
+                python -m benchmarks.bench_pipeline --json base.json            # save a baseline
+                python -m benchmarks.bench_pipeline --baseline base.json        # compare against it
+                python -m benchmarks.bench_pipeline --trace trace.json          # timeline for chrome://tracing
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import argparse
+import itertools
+import json
+import time
+import numpy as np
+
+from helpers.concerto_classes import Config, NeuroListener, OrchestraGenerator
+from helpers.instrumentation import PipelineStats
+from helpers.midi_sinks import NullSink, RecordingSink
+from helpers.tracing import Tracer
+
+
+def spike_source(rate, neuron_ids, duration, bursty=False, burst_factor=10, burst_period=0.1, seed=0):
+    '''
+    Poisson spike train of `rate` events/s spread uniformly over neuron_ids, timestamps in us.
+    bursty concentrates the same mean rate into on-windows covering 1/burst_factor of each period.
+    '''
+    rng = np.random.default_rng(seed)
+    n = rng.poisson(rate * duration)
+    if bursty:
+        period_idx = rng.integers(0, max(1, int(duration / burst_period)), n)
+        times = (period_idx + rng.random(n) / burst_factor) * burst_period
+    else:
+        times = rng.random(n) * duration
+    times = np.sort(np.rint(times * 1e6).astype(np.int64))
+    ids = rng.choice(np.asarray(neuron_ids), n)
+    return times, ids
+
+
+def run_scenario(config, rate, n_neurons, duration, population=False, max_queue=500, bursty=False, seed=0, record=False,
+                 tracer=None):
+    mapping = (config.population if population else config.id)
+    neuron_ids = sorted(mapping)[:n_neurons]
+    times, ids = spike_source(rate, neuron_ids, duration, bursty=bursty, seed=seed)
+
+    stats = PipelineStats()
+    sink = (RecordingSink() if record else NullSink())
+    generator = OrchestraGenerator(config, population=population, max_queue=max_queue, stats=stats, sink=sink)
+    listener = NeuroListener(times, ids, time_unit=1e-6)
+    listener.stats = stats
+    listener.attach(generator)
+    if tracer is not None:
+        tracer.instrument(listener, generator)
+
+    cpu0 = time.process_time()
+    wall0 = time.perf_counter()
+    replay = listener.start_replay(speed=1.0)
+    wall_replay = time.perf_counter() - wall0
+    # Let the worker flush what is still pending
+    flush_until = time.monotonic() + 0.5
+    while (len(generator.pending_notes) or generator.note_off_heap) and time.monotonic() < flush_until:
+        time.sleep(0.001)
+    wall = time.perf_counter() - wall0
+    cpu = time.process_time() - cpu0
+    generator.cleanup()
+
+    snap = stats.snapshot()
+    counters = snap['counters']
+    events = len(ids)
+    dropped = counters.get('dropped', 0)
+    return {'rate': rate, 'neurons': len(neuron_ids), 'mapping': ('population' if population else 'id'),
+            'max_queue': max_queue, 'bursty': bursty, 'events': events,
+            'throughput': events / wall_replay if wall_replay > 0 else 0.0,
+            'drop_rate': dropped / events if events else 0.0,
+            'coalesce_rate': counters.get('coalesced', 0) / events if events else 0.0,
+            'midi_messages': sink.count,
+            'p50': snap['stages']['dequeue']['p50'], 'p99': snap['stages']['dequeue']['p99'],
+            'replay_lag_max': replay['drift_max'],
+            'cpu': cpu / wall if wall > 0 else 0.0}
+
+
+def _key(r):
+    return (r['rate'], r['neurons'], r['mapping'], r['max_queue'], r['bursty'])
+
+
+def print_results(results, baseline=None):
+    base = {_key(r): r for r in (baseline or [])}
+    print(f"{'rate':>8} {'nrn':>4} {'map':>10} {'maxq':>5} {'burst':>5} {'ev/s':>10} {'drop%':>6} "
+          f"{'coal%':>6} {'p50us':>7} {'p99us':>7} {'lag ms':>7} {'cpu%':>5}")
+    for r in results:
+        line = (f"{r['rate']:>8} {r['neurons']:>4} {r['mapping']:>10} {r['max_queue']:>5} {str(r['bursty']):>5} "
+                f"{r['throughput']:>10.0f} {100 * r['drop_rate']:>6.2f} {100 * r['coalesce_rate']:>6.2f} "
+                f"{r['p50'] * 1e6:>7.0f} {r['p99'] * 1e6:>7.0f} {r['replay_lag_max'] * 1e3:>7.2f} {100 * r['cpu']:>5.0f}")
+        ref = base.get(_key(r))
+        if ref is not None:
+            line += (f"   vs baseline: ev/s x{r['throughput'] / max(ref['throughput'], 1e-9):.2f}"
+                     f" p99 x{r['p99'] / max(ref['p99'], 1e-9):.2f} cpu x{r['cpu'] / max(ref['cpu'], 1e-9):.2f}")
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concerto synthetic pipeline benchmark")
+    parser.add_argument('--config', default='helpers/config_orchestra.yaml')
+    parser.add_argument('--rates', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--neurons', type=int, nargs='+', default=[80])
+    parser.add_argument('--max-queue', type=int, nargs='+', default=[500])
+    parser.add_argument('--mapping', choices=['id', 'population'], nargs='+', default=['id', 'population'])
+    parser.add_argument('--duration', type=float, default=2.0)
+    parser.add_argument('--bursty', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help="write results to this file")
+    parser.add_argument('--baseline', help="compare against results written with --json")
+    parser.add_argument('--trace', help="write a Chrome trace-event timeline of the runs to this file")
+    parser.add_argument('--trace-sample', type=float, default=1.0)
+    args = parser.parse_args()
+
+    config = Config(args.config, 'brain_to_wave')
+    tracer = (Tracer(sample=args.trace_sample) if args.trace else None)
+    results = []
+    for rate, n_neurons, max_queue, mapping in itertools.product(args.rates, args.neurons, args.max_queue, args.mapping):
+        results.append(run_scenario(config, rate, n_neurons, args.duration, population=(mapping == 'population'),
+                                    max_queue=max_queue, bursty=args.bursty, seed=args.seed, tracer=tracer))
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=1)
+    if tracer is not None:
+        print(f"Trace written to {tracer.export_chrome(args.trace)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""
+Project: Concerto
+Description: Regression check of spike_format.iter_merged. Random per-population trains (with tied timestamps) go
+            through both merge paths, heap (lists, as in the data/*.pkl recordings) and vectorized (arrays), and
+            every output column is compared with a full np.lexsort of the concatenated trains.
+
+            Run from the repository root:
+                python -m benchmarks.check_merge --cases 300
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import argparse
+import sys
+import numpy as np
+
+from helpers.spike_format import iter_merged
+
+
+def reference_merge(ts_lists, id_lists):
+    ''' (times, ids, population_index) by full sort: time, then population, then position in the population '''
+    times = np.concatenate([np.asarray(t, dtype=np.float64) for t in ts_lists])
+    ids = np.concatenate([np.asarray(i, dtype=np.int64) for i in id_lists])
+    pops = np.concatenate([np.full(len(t), k, dtype=np.int64) for k, t in enumerate(ts_lists)])
+    position = np.concatenate([np.arange(len(t)) for t in ts_lists])
+    order = np.lexsort((position, pops, times))
+    return times[order], ids[order], pops[order]
+
+
+def random_trains(rng, max_populations=6, max_events=40, max_time=20):
+    n = int(rng.integers(1, max_populations + 1))
+    ts_lists, id_lists = [], []
+    for _ in range(n):
+        size = int(rng.integers(0, max_events + 1))
+        ts_lists.append(np.sort(rng.integers(0, max_time, size)).astype(np.float64))
+        id_lists.append(rng.integers(0, 256, size))
+    return ts_lists, id_lists
+
+
+def merged(ts_lists, id_lists, chunk_size):
+    chunks = list(iter_merged(ts_lists, id_lists, chunk_size=chunk_size))
+    if not chunks:
+        return np.zeros(0), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return tuple(np.concatenate([c[k] for c in chunks]) for k in range(3))
+
+
+def check(cases=300, seed=0):
+    ''' Number of failing (case, path) pairs, each failure printed '''
+    rng = np.random.default_rng(seed)
+    failures = 0
+    for case in range(cases):
+        ts_lists, id_lists = random_trains(rng)
+        expected = reference_merge(ts_lists, id_lists)
+        chunk_size = int(rng.integers(1, 16))
+        inputs = {'heap': ([t.tolist() for t in ts_lists], [i.tolist() for i in id_lists]),
+                  'arrays': (ts_lists, id_lists)}
+        for path, (ts_in, id_in) in inputs.items():
+            got = merged(ts_in, id_in, chunk_size)
+            for name, a, b in zip(('times', 'ids', 'population_index'), got, expected):
+                if not np.array_equal(np.asarray(a, dtype=np.float64), b.astype(np.float64)):
+                    print(f"case {case} ({path}, chunk_size {chunk_size}): {name} differs")
+                    failures += 1
+                    break
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cases', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    failures = check(args.cases, args.seed)
+    print(f"{args.cases} cases, {failures} failures")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -17,19 +17,17 @@ from pyparsing import delimitedList
 from texel_params import *
 from helpers.concerto_classes import *
 import pickle
+from helpers.spike_format import iter_merged
+from helpers.capture import CaptureObserver
 
 
 def merge_and_sort(ts_lists, id_lists):
-    # Flatten into list of (time, id) pairs
-    events = []
-    for t_list, i_list in zip(ts_lists, id_lists):
-        #events.extend(zip(t_list, i_list))
-        events.extend((float(t), i) for t, i in zip(t_list, i_list))
-    # Sort by time
-    events.sort(key=lambda x: x[0])
-    # Unpack back into two lists
-    times, ids = zip(*events)
-    return list(times), list(ids)
+    # Each population is already time-ordered: k-way merge instead of flatten + full sort
+    times, ids = [], []
+    for t_chunk, i_chunk, _ in iter_merged(ts_lists, id_lists):
+        times.extend(t_chunk.tolist())
+        ids.extend(i_chunk.tolist())
+    return times, ids
 
 def read_network_output(path):
     with open(path, "rb") as f:
@@ -90,8 +88,11 @@ def main_texel():
     hwtexel_sub = NeuroListener_Texel(parameters, flags, 0, neuron_list)#[1,20])  # it does not handle 1000, max_queue 300 does not help
     # Neuron list only used for configuration not for reading
     midi_gen = OrchestraGenerator(config_sheet, debug=False)
+    # Record the session, replay later with capture_listener(path)
+    capture = CaptureObserver(time.strftime('session_%Y%m%d_%H%M%S.cap'))
 
     hwtexel_sub.attach(midi_gen)
+    hwtexel_sub.attach(capture)
     hwtexel_sub.start_event_listener()
     #print("Stimulate {}".format(neuron_list[:3]))
     hwtexel_sub.start_stimulation(neuron_list[:3])
@@ -106,6 +107,7 @@ def main_texel():
     input()
     print("Exiting...")
     hwtexel_sub.stop_listener()
+    capture.close()
 
     midi_gen.silence()
     midi_gen.cleanup()
@@ -115,20 +117,106 @@ def main_network_replay():
     config_sheet = Config('helpers/config_orchestra.yaml', 'brain_to_wave')
 
     (ts,ids) = read_network_output('data/net_states_sparse.pkl')#
-    tstamp_list, ids_list = merge_and_sort(ts, ids)
-    hwdummy_sub = NeuroListener(tstamp_list, ids_list, delay=0.001)  # it does not handle 1000, max_queue 300 does not help
+    # Timestamps of the network recordings are in seconds, merged lazily while playing
+    hwdummy_sub = NeuroListener.from_populations(ts, ids, time_unit=1.0)
     midi_gen = OrchestraGenerator(config_sheet, population=True, debug=False)
 
     hwdummy_sub.attach(midi_gen)
-    hwdummy_sub.start_streaming_events()
+    stats = hwdummy_sub.start_replay(speed=1.0)
+    print("Replayed {events} events in {batches} batches, drift mean {drift_mean:.6f}s max {drift_max:.6f}s".format(**stats))
+
+    print("Press Enter to exit...")
+    input()
+    print("Exiting...")
+    midi_gen.silence()
+    midi_gen.cleanup()
+
+def main_recording_replay(path='data/net_states_sparse.spk'):
+    ''' Replay a columnar recording, convert pickles first: python -m helpers.spike_format in.pkl out.spk '''
+    config_sheet = Config('helpers/config_orchestra.yaml', 'brain_to_wave')
+
+    hwdummy_sub = NeuroListener.from_recording(path)
+    midi_gen = OrchestraGenerator(config_sheet, population=True, debug=False)
+
+    hwdummy_sub.attach(midi_gen)
+    stats = hwdummy_sub.start_replay(speed=1.0)
+    print("Replayed {events} events in {batches} batches, drift mean {drift_mean:.6f}s max {drift_max:.6f}s".format(**stats))
+
+    print("Press Enter to exit...")
+    input()
+    print("Exiting...")
+    midi_gen.silence()
+    midi_gen.cleanup()
+
+def main_texel_multiprocess():
+    ''' Texel reader and stimulation in their own process, mapping and MIDI output in this one '''
+    from helpers.acquisition import AcquisitionProcess, texel_acquisition
+    config_sheet = Config('helpers/config_orchestra.yaml', 'brain_to_wave')
+    neuron_list = [1,5,10,15,20,35,40,50,66]
+    acquisition = AcquisitionProcess(texel_acquisition, parameters, flags, 0, neuron_list,
+                                     stimulate=neuron_list[:3], rate=100.0)
+    midi_gen = OrchestraGenerator(config_sheet, debug=False)
+
+    listener = acquisition.start()
+    listener.attach(midi_gen)
 
     print("Press Enter to exit...")
     input()
     print("Exiting...")
+    acquisition.stop()
+    print(listener.reader_stats())
+    midi_gen.silence()
+    midi_gen.cleanup()
+
+def main_dynapse_standin():
+    ''' NeuroListener_Dynapse on the board stand-in, swap the sink for the samna sink node on hardware '''
+    from helpers.dynapse_sim import DynapseStandInSink
+    config_sheet = Config('helpers/config_orchestra.yaml', 'brain_to_wave')
+    monitored_neurons = [(0, 1, 10), (2, 3, 77), (1, 0, 5), (0, 0, 1)]
+    listener = NeuroListener_Dynapse(DynapseStandInSink(monitored_neurons, rate=20.0),
+                                     monitored_neurons=monitored_neurons)
+    midi_gen = OrchestraGenerator(config_sheet, debug=False)
+
+    listener.attach(midi_gen)
+    listener.start_event_listener()
+
+    print("Press Enter to exit...")
+    input()
+    print("Exiting...")
+    listener.stop_listener()
+    print(listener.reader_stats())
+    midi_gen.silence()
+    midi_gen.cleanup()
+
+def main_network_monitor():
+    ''' Network replay with live statistics printed next to the sound '''
+    import threading
+    from helpers.spike_stats import SpikeStatsObserver
+    config_sheet = Config('helpers/config_orchestra.yaml', 'brain_to_wave')
+
+    (ts,ids) = read_network_output('data/net_states_sparse.pkl')
+    hwdummy_sub = NeuroListener.from_populations(ts, ids, time_unit=1.0)
+    midi_gen = OrchestraGenerator(config_sheet, population=True, debug=False)
+    monitor = SpikeStatsObserver(config_sheet, population=True, time_unit=1.0)
+
+    hwdummy_sub.attach(midi_gen)
+    hwdummy_sub.attach(monitor)
+    replay = threading.Thread(target=hwdummy_sub.start_replay, daemon=True)
+    replay.start()
+    while replay.is_alive():
+        time.sleep(1.0)
+        rates = monitor.population_rates()
+        print("Hz per neuron {}  synchrony {:.2f}".format({note: round(rate, 1) for note, rate in rates.items()},
+                                                          monitor.synchrony()[1]))
+    monitor.cleanup()
     midi_gen.silence()
     midi_gen.cleanup()
 
 if __name__ == "__main__":
     #main_dummy_input()
     #main_network_replay()
+    #main_recording_replay()
+    #main_texel_multiprocess()
+    #main_dynapse_standin()
+    #main_network_monitor()
     main_texel()
@@ -0,0 +1,180 @@
+"""
+Project: Concerto
+Description: Multi-process mode. Hardware acquisition (reader and stimulator) runs in its own process and writes
+            (ts, id) records into a SpikeRing in shared memory; the mapping / MIDI process consumes the ring with a
+            RingListener subject. Each side has its own interpreter and GIL, and can be pinned to its own core.
+
+                acquisition = AcquisitionProcess(texel_acquisition, parameters, flags, 0, neuron_list)
+                listener = acquisition.start()
+                listener.attach(OrchestraGenerator(config))
+                ...
+                acquisition.stop()
+
+            Acquisition functions run in the child as function(ring, stop, *args, **kwargs), must be module level
+            (picklable) and return once `stop` is set.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import multiprocessing as mp
+import os
+import threading
+import time
+import numpy as np
+from multiprocessing import shared_memory
+
+from helpers.concerto_classes import Subject, NeuroListener_Texel
+from helpers.spike_ring import SpikeRing, ring_bytes
+
+
+def _pin(cpu):
+    if cpu is not None and hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, {cpu})
+
+
+def _acquisition_main(shm_name, function, args, kwargs, stop, cpu):
+    _pin(cpu)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    ring = SpikeRing(buffer=shm.buf, create=False)
+    try:
+        function(ring, stop, *args, **kwargs)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        ring.close()
+        shm.close()
+
+
+def texel_acquisition(ring, stop, parameters, flags, core, neuron_list, stimulate=None, rate=None, **kwargs):
+    ''' Texel reader (and stimulation of `stimulate` at `rate` Hz) writing into ring until stop is set '''
+    listener = NeuroListener_Texel(parameters, flags, core, neuron_list, ring=ring, **kwargs)
+    listener.start_event_listener(dispatch=False)
+    if stimulate:
+        listener.start_stimulation(stimulate, rate=rate)
+    stop.wait()
+    listener.stop_listener()
+
+
+def replay_acquisition(ring, stop, times, ids, time_unit=1e-6, speed=1.0, tick=0.001):
+    ''' Stand-in for hardware: writes a recording into ring in real time (x speed) '''
+    times = np.asarray(times, dtype=np.float64)
+    ids = np.asarray(ids, dtype=np.int32)
+    offsets = (times - times[0]) * (time_unit / speed) if len(times) else times
+    t0 = time.monotonic()
+    i = 0
+    while i < len(ids) and not stop.is_set():
+        j = int(np.searchsorted(offsets, time.monotonic() - t0, side='right'))
+        if j > i:
+            ring.write(times[i:j], ids[i:j])
+            i = j
+        stop.wait(tick)
+
+
+class RingListener(Subject):
+    """
+    Subject fed from a SpikeRing written by another process: one thread drains the ring in chunks into
+    notify_batch, polling every idle_wait seconds while it is empty.
+    """
+    def __init__(self, ring, max_chunk=4096, idle_wait=0.0005):
+        super().__init__()
+        self.ring = ring
+        self.max_chunk = max_chunk
+        self.idle_wait = idle_wait
+        self._streaming_flag = False
+        self.dispatcher = None
+        self._dispatched = 0
+        self.final_stats = None
+
+    def start_event_listener(self):
+        self._streaming_flag = True
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+        self.dispatcher.start()
+
+    def _dispatch_loop(self):
+        while self._streaming_flag:
+            s_ts, s_id = self.ring.read(self.max_chunk)
+            if not len(s_id):
+                time.sleep(self.idle_wait)
+                continue
+            self.notify_batch(s_ts, s_id)
+            self._dispatched += len(s_id)
+
+    def reader_stats(self):
+        ''' Dispatch counters, the last ones before the ring was closed once the acquisition stopped '''
+        if self.final_stats is not None:
+            return dict(self.final_stats)
+        return {'dispatched': self._dispatched, 'pending': len(self.ring), 'overflow': self.ring.overflow}
+
+    def stop_listener(self):
+        self._streaming_flag = False
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+            self.dispatcher = None
+
+
+class AcquisitionProcess():
+    """
+    Owns the shared memory ring and the acquisition process. start() creates both and returns the RingListener
+    of this process, stop() stops the child (terminated after `timeout` s), the listener and frees the memory.
+    cpus=(acquisition cpu, output cpu) pins each process to one core.
+    """
+    def __init__(self, function, *args, capacity=1 << 18, cpus=None, start_method='spawn', timeout=5.0, **kwargs):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.capacity = capacity
+        self.cpus = cpus
+        self.timeout = timeout
+        self._context = mp.get_context(start_method)
+        self.shm = None
+        self.ring = None
+        self.process = None
+        self.listener = None
+        self._stop = None
+
+    def start(self, max_chunk=4096):
+        self.shm = shared_memory.SharedMemory(create=True, size=ring_bytes(self.capacity))
+        self.ring = SpikeRing(self.capacity, buffer=self.shm.buf, create=True)
+        self._stop = self._context.Event()
+        cpu = (self.cpus[0] if self.cpus else None)
+        self.process = self._context.Process(target=_acquisition_main, daemon=True,
+                                             args=(self.shm.name, self.function, self.args, self.kwargs, self._stop, cpu))
+        self.process.start()
+        if self.cpus:
+            _pin(self.cpus[1])
+        self.listener = RingListener(self.ring, max_chunk=max_chunk)
+        self.listener.start_event_listener()
+        return self.listener
+
+    def is_alive(self):
+        return self.process is not None and self.process.is_alive()
+
+    def stop(self):
+        if self.process is None:
+            return
+        self._stop.set()
+        self.process.join(self.timeout)
+        if self.process.is_alive():
+            self.process.terminate()
+            self.process.join()
+        # The child wrote everything it will write: deliver the rest before closing
+        self.listener.stop_listener()
+        while len(self.ring):
+            s_ts, s_id = self.ring.read(self.listener.max_chunk)
+            self.listener.notify_batch(s_ts, s_id)
+            self.listener._dispatched += len(s_id)
+        self.listener.final_stats = self.listener.reader_stats()
+        self.ring.close()
+        self.shm.close()
+        self.shm.unlink()
+        self.process = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,260 @@
+"""
+Project: Concerto
+Description: Audio output backend, for machines without a MIDI synth. SynthSink is a MIDI sink (drop-in for
+            OrchestraGenerator(sink=...)) that plays note on/off messages on a vectorized wavetable synth: one voice
+            per (channel, note), every active voice rendered into the audio chunk in one NumPy pass with
+            continuous phases and per-voice attack/release envelopes. Outputs: PyAudio (callback driven), WAV file
+            and null for headless runs; render_timeline() renders recorded (seconds, message) pairs offline.
+
+                generator = OrchestraGenerator(config, sink=SynthSink())                     # sound card
+                generator = OrchestraGenerator(config, sink=SynthSink(WavOutput('out.wav')))  # file
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import threading
+import time
+import wave
+import numpy as np
+
+from helpers.midi_sinks import MidiSink
+
+TABLE_BITS = 11
+TABLE_SIZE = 1 << TABLE_BITS
+N_VOICES = 16 * 128   # (channel, note)
+SILENT = 1e-4
+
+
+def wavetable(harmonics=(1.0,), size=TABLE_SIZE):
+    ''' One period of an additive waveform, harmonics[k] is the amplitude of harmonic k + 1, peak normalised '''
+    phase = np.arange(size) / size
+    table = np.zeros(size)
+    for k, amplitude in enumerate(harmonics):
+        table += amplitude * np.sin(2 * np.pi * (k + 1) * phase)
+    peak = np.max(np.abs(table))
+    return (table / peak if peak > 0 else table).astype(np.float32)
+
+
+WAVEFORMS = {'sine': (1.0,),
+             'organ': (1.0, 0.5, 0.25, 0.125),
+             'saw': tuple(1.0 / k for k in range(1, 16)),
+             'square': tuple((1.0 / k if k % 2 else 0.0) for k in range(1, 16))}
+
+
+class AudioSynth():
+    """
+    Voice state lives in flat arrays indexed by channel * 128 + note. render(n) advances every active voice
+    by n frames: wavetable lookup on continuous phases, times an envelope that approaches the velocity level
+    (gate on, attack time constant) or 0 (gate off, release time constant) exponentially.
+    """
+    def __init__(self, rate=44100, chunk=512, waveform='sine', attack=0.005, release=0.05, gain=0.2):
+        self.rate = rate
+        self.chunk = chunk
+        self.gain = gain
+        self.table = wavetable(WAVEFORMS[waveform] if isinstance(waveform, str) else waveform)
+        notes = np.arange(N_VOICES) % 128
+        # 32 bit fixed point phases: the accumulator wraps by itself, the top bits index the table
+        frequency = 440.0 * 2.0 ** ((notes - 69) / 12.0)
+        self.increment = np.rint(frequency / rate * 2.0 ** 32).astype(np.uint32)   # per frame
+        self.phase = np.zeros(N_VOICES, dtype=np.uint32)
+        self.level = np.zeros(N_VOICES, dtype=np.float32)     # envelope value at the start of the next chunk
+        self.target = np.zeros(N_VOICES, dtype=np.float32)    # velocity level while the gate is on
+        self.gate = np.zeros(N_VOICES, dtype=bool)
+        self.active = np.zeros(N_VOICES, dtype=bool)
+        self.attack = attack
+        self.release = release
+        self._lock = threading.Lock()
+        self._curves = {}
+        self._frames = np.arange(chunk + 1, dtype=np.uint32)
+        self._out = np.zeros(chunk, dtype=np.float32)
+
+    def _curve(self, n, tau):
+        # exp(-k / (tau * rate)) for k = 1..n, shared by every voice with the same time constant
+        curve = self._curves.get(tau)
+        if curve is None or len(curve) < n:
+            curve = self._curves[tau] = np.exp(-self._frames[1:].astype(np.float64) / max(tau * self.rate, 1e-9)).astype(np.float32)
+        return curve[:n]
+
+    def handle(self, message):
+        ''' Apply one MIDI message (note on, note off, CC 120/123 all off) '''
+        status = message[0] & 0xF0
+        voice = (message[0] & 0x0F) * 128 + message[1] if len(message) > 1 else 0
+        if status == 0x90 and message[2] > 0:
+            self.target[voice] = message[2] / 127.0
+            self.gate[voice] = True
+            self.active[voice] = True
+        elif status == 0x80 or status == 0x90:
+            self.gate[voice] = False
+        elif status == 0xB0 and message[1] in (120, 123):
+            channel = slice((message[0] & 0x0F) * 128, (message[0] & 0x0F) * 128 + 128)
+            self.gate[channel] = False
+            if message[1] == 120:
+                self.active[channel] = False
+                self.level[channel] = 0.0
+
+    def handle_batch(self, messages):
+        with self._lock:
+            for message in messages:
+                self.handle(message)
+
+    def render(self, n=None):
+        ''' Next n frames (float32, mono) of all active voices, the returned buffer is reused '''
+        n = (self.chunk if n is None else n)
+        if n > len(self._out):
+            self._out = np.zeros(n, dtype=np.float32)
+            self._frames = np.arange(n + 1, dtype=np.uint32)
+        out = self._out[:n]
+        with self._lock:
+            voices = np.flatnonzero(self.active)
+            if not len(voices):
+                out[:] = 0.0
+                return out
+            gate = self.gate[voices]
+            goal = np.where(gate, self.target[voices], np.float32(0.0))
+            curves = np.stack((self._curve(n, self.release), self._curve(n, self.attack)))[gate.astype(np.intp)]
+            envelope = goal[:, None] + (self.level[voices] - goal)[:, None] * curves
+            increment = self.increment[voices]
+            phases = self.phase[voices, None] + increment[:, None] * self._frames[:n]
+            samples = self.table[phases >> np.uint32(32 - TABLE_BITS)]
+            # Mix: sum over voices of sample x envelope
+            np.einsum('vn,vn->n', samples, envelope, out=out)
+
+            self.phase[voices] += increment * np.uint32(n)
+            self.level[voices] = envelope[:, -1]
+            done = (~gate) & (envelope[:, -1] < SILENT)
+            self.active[voices[done]] = False
+            self.level[voices[done]] = 0.0
+        # Soft limit the mix instead of clipping when many voices sound together
+        np.tanh(out * self.gain, out=out)
+        return out
+
+
+class NullAudioOutput():
+    ''' Discards audio, counts frames '''
+    def __init__(self):
+        self.frames = 0
+
+    def write(self, samples):
+        self.frames += len(samples)
+
+    def close(self):
+        pass
+
+
+class WavOutput():
+    ''' 16-bit mono WAV file '''
+    def __init__(self, path, rate=44100):
+        self.rate = rate
+        self.frames = 0
+        self._file = wave.open(path, 'wb')
+        self._file.setnchannels(1)
+        self._file.setsampwidth(2)
+        self._file.setframerate(rate)
+
+    def write(self, samples):
+        self._file.writeframes((np.clip(samples, -1.0, 1.0) * 32767).astype('<i2').tobytes())
+        self.frames += len(samples)
+
+    def close(self):
+        self._file.close()
+
+
+class PyAudioOutput():
+    ''' Sound card through PyAudio in callback mode: the audio thread pulls chunks, nothing blocks on write '''
+    def __init__(self, rate=44100, chunk=512):
+        import pyaudio
+        self._pyaudio = pyaudio
+        self.rate = rate
+        self.chunk = chunk
+        self.p = pyaudio.PyAudio()
+        self.stream = None
+
+    def start(self, render):
+        pyaudio = self._pyaudio
+
+        def callback(in_data, frame_count, time_info, status):
+            return render(frame_count).tobytes(), pyaudio.paContinue
+
+        self.stream = self.p.open(format=pyaudio.paFloat32, channels=1, rate=self.rate, output=True,
+                                  frames_per_buffer=self.chunk, stream_callback=callback)
+        self.stream.start_stream()
+
+    def close(self):
+        if self.stream is not None:
+            self.stream.stop_stream()
+            self.stream.close()
+        self.p.terminate()
+
+
+class SynthSink(MidiSink):
+    """
+    MIDI sink playing on an AudioSynth. Outputs with start(render) (PyAudio) pull audio themselves; for outputs
+    with write() a thread renders one chunk per chunk period in real time. realtime=False starts nothing,
+    the caller renders (see render_timeline).
+    """
+    def __init__(self, output=None, rate=44100, chunk=512, realtime=True, **synth_kwargs):
+        self.synth = AudioSynth(rate=rate, chunk=chunk, **synth_kwargs)
+        self.output = (output if output is not None else PyAudioOutput(rate, chunk))
+        self.running = False
+        self.worker = None
+        if realtime:
+            self.running = True
+            if hasattr(self.output, 'start'):
+                self.output.start(self.synth.render)
+            else:
+                self.worker = threading.Thread(target=self._render_loop, daemon=True)
+                self.worker.start()
+
+    def send_batch(self, messages):
+        self.synth.handle_batch(messages)
+
+    def _render_loop(self):
+        period = self.synth.chunk / self.synth.rate
+        deadline = time.monotonic()
+        while self.running:
+            self.output.write(self.synth.render())
+            deadline += period
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+
+    def close(self):
+        self.running = False
+        if self.worker is not None:
+            self.worker.join()
+        self.output.close()
+
+
+def render_timeline(messages, output=None, rate=44100, chunk=512, tail=0.5, **synth_kwargs):
+    '''
+    Offline: play (seconds, message) pairs (e.g. RecordingSink.messages or midi_render.render()) with
+    sample accurate message times, into output (an array is returned when None) plus `tail` s of release.
+    '''
+    synth = AudioSynth(rate=rate, chunk=chunk, **synth_kwargs)
+    messages = sorted(messages, key=lambda item: item[0])
+    t0 = messages[0][0] if messages else 0.0
+    total = int(((messages[-1][0] - t0) if messages else 0.0) * rate) + int(tail * rate)
+    pieces = []
+    frame, k = 0, 0
+    while frame < total:
+        # Apply the messages due at this frame, then render up to the next message or chunk end
+        while k < len(messages) and int((messages[k][0] - t0) * rate) <= frame:
+            synth.handle(messages[k][1])
+            k += 1
+        until = frame + chunk
+        if k < len(messages):
+            until = min(until, max(frame + 1, int((messages[k][0] - t0) * rate)))
+        until = min(until, total)
+        samples = synth.render(until - frame)
+        if output is None:
+            pieces.append(samples.copy())
+        else:
+            output.write(samples)
+        frame = until
+    if output is not None:
+        output.close()
+        return None
+    return np.concatenate(pieces) if pieces else np.zeros(0, dtype=np.float32)
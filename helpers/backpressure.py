@@ -0,0 +1,178 @@
+"""
+Project: Concerto
+Description: Adaptive backpressure for the MIDI pipeline. The generator worker reports how fast the MIDI
+            output actually drains; the admission limit on pending notes follows so the backlog can always
+            be flushed within a target latency. What gets dropped is decided by a pluggable policy, and
+            every drop is counted against the policy that made it.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import random
+from abc import ABC
+
+
+class DropPolicy(ABC):
+    """
+    A policy may refuse events on arrival (admit) and chooses which pending note to give up when the
+    table is over the admission limit (evict). Both run under the generator lock. Policies that do not
+    override admit() leave filters False, so generators may coalesce a batch before admission.
+    """
+    name = 'policy'
+    filters = False
+
+    def admit(self, control, note, velocity, now) -> bool:
+        return True
+
+    def evict(self, control, table) -> int:
+        return table.pop_oldest()
+
+
+class DropOldest(DropPolicy):
+    ''' Give up the note waiting the longest (previous max_queue behaviour) '''
+    name = 'drop_oldest'
+
+
+class DropLowestVelocity(DropPolicy):
+    ''' Give up the quietest pending note, oldest first among equals '''
+    name = 'drop_lowest_velocity'
+
+    def evict(self, control, table) -> int:
+        note = min(table.notes(), key=lambda n: table.velocity[n])
+        table.remove(note)
+        return note
+
+
+class TokenBucket(DropPolicy):
+    ''' Per-note rate limit: each note may retrigger `rate` times per second with bursts up to `burst` '''
+    name = 'token_bucket'
+    filters = True
+
+    def __init__(self, rate=50.0, burst=4.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = [burst] * 128
+        self.last = [0.0] * 128
+
+    def admit(self, control, note, velocity, now) -> bool:
+        tokens = min(self.burst, self.tokens[note] + (now - self.last[note]) * self.rate)
+        self.last[note] = now
+        if tokens < 1.0:
+            self.tokens[note] = tokens
+            return False
+        self.tokens[note] = tokens - 1.0
+        return True
+
+
+class ProbabilisticThinning(DropPolicy):
+    ''' Keep each arriving event with probability drain capacity / arrival rate (at least min_keep) '''
+    name = 'thinning'
+    filters = True
+
+    def __init__(self, min_keep=0.01, seed=None):
+        self.min_keep = min_keep
+        self._random = random.Random(seed).random
+
+    def admit(self, control, note, velocity, now) -> bool:
+        capacity = control.drain_rate
+        if capacity is None or control.arrival_rate <= capacity:
+            return True
+        return self._random() < max(self.min_keep, capacity / control.arrival_rate)
+
+
+POLICIES = {p.name: p for p in (DropOldest, DropLowestVelocity, TokenBucket, ProbabilisticThinning)}
+
+
+class Backpressure():
+    """
+    Admission control of one generator. The worker reports each flush (messages sent, time spent);
+    an EWMA of the per-message cost gives the drain rate and the admission limit is the number of
+    pending notes that can be flushed within target_latency, capped by max_pending. target_latency=None
+    pins the limit to max_pending and ignores drain reports, so admission only depends on the events
+    (offline rendering).
+    """
+    def __init__(self, policy=None, max_pending=128, target_latency=0.005, alpha=0.2):
+        if isinstance(policy, str):
+            policy = POLICIES[policy]()
+        self.policy = policy if policy is not None else DropOldest()
+        self.max_pending = max_pending
+        self.target_latency = target_latency
+        self.alpha = alpha
+        self.limit = max_pending
+        self.message_cost = None     # seconds per MIDI message, EWMA
+        self.arrival_interval = None # seconds between arrivals, EWMA per event
+        self._last_arrival = None
+        self._unaccounted = 0        # events reported without the clock advancing
+        self.drops = {}              # policy name -> dropped events
+
+    @property
+    def drain_rate(self):
+        ''' Messages per second the output sustains, None until measured '''
+        if not self.message_cost:
+            return None
+        return 1.0 / self.message_cost
+
+    @property
+    def arrival_rate(self):
+        ''' Events per second, the inverse of the mean interval (0.0 until measured) '''
+        if not self.arrival_interval:
+            return 0.0
+        return 1.0 / self.arrival_interval
+
+    def _count_drop(self, n=1):
+        name = self.policy.name
+        self.drops[name] = self.drops.get(name, 0) + n
+
+    def record_arrivals(self, n, now):
+        ''' n events arrived at now. The EWMA runs over intervals, not n / dt: for Poisson arrivals the mean
+        of 1 / dt is far above the rate, the mean interval is unbiased. A batch counts as n intervals. '''
+        if n <= 0:
+            return
+        if self._last_arrival is None:
+            self._last_arrival = now
+            return
+        n += self._unaccounted
+        if now <= self._last_arrival:
+            self._unaccounted = n
+            return
+        interval = (now - self._last_arrival) / n
+        if self.arrival_interval is None:
+            self.arrival_interval = interval
+        else:
+            self.arrival_interval += (1.0 - (1.0 - self.alpha) ** n) * (interval - self.arrival_interval)
+        self._last_arrival = now
+        self._unaccounted = 0
+
+    def admit(self, note, velocity, now) -> bool:
+        if self.policy.admit(self, note, velocity, now):
+            return True
+        self._count_drop()
+        return False
+
+    def enforce(self, table):
+        ''' Evict pending notes until the table is within the admission limit, returns how many '''
+        dropped = 0
+        while len(table) > self.limit:
+            self.policy.evict(self, table)
+            self._count_drop()
+            dropped += 1
+        return dropped
+
+    def record_drain(self, n_messages, elapsed):
+        ''' Worker side: n_messages were handed to the MIDI output in elapsed seconds '''
+        if self.target_latency is None or n_messages <= 0 or elapsed <= 0:
+            return
+        cost = elapsed / n_messages
+        if self.message_cost is None:
+            self.message_cost = cost
+        else:
+            self.message_cost += self.alpha * (cost - self.message_cost)
+        # A pending note costs a note on and, later, a note off
+        self.limit = max(1, min(self.max_pending, int(self.target_latency / (2 * self.message_cost))))
+
+    def stats(self):
+        return {'policy': self.policy.name, 'limit': self.limit, 'drain_rate': self.drain_rate,
+                'arrival_rate': self.arrival_rate, 'drops': dict(self.drops)}
@@ -0,0 +1,177 @@
+"""
+Project: Concerto
+Description: Live spike capture. CaptureObserver attaches to any Subject and copies each batch into a SpikeRing; a
+            background thread drains the ring into zlib-compressed chunks appended to a capture file, with periodic
+            fsync. The observer never waits on the disk: when the writer falls behind the ring overflows and the
+            lost events are counted. Captures replay through NeuroListener with their original timing:
+
+                listener = capture_listener('session.cap')
+                python -m helpers.capture session.cap session.spk     # convert to a columnar recording
+
+            Layout (little endian):
+                magic       8s   b'CNCCAP01'
+                meta_len    u32  length of the JSON metadata block that follows
+                chunks      repeated: n_events u32, payload_len u32, crc32 u32, zlib(int64 delta timestamps,
+                            int32 ids). A torn last chunk (crash) is ignored on reading.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import json
+import os
+import struct
+import sys
+import threading
+import time
+import zlib
+import numpy as np
+
+from helpers.concerto_classes import Observer, Subject, NeuroListener
+from helpers.spike_format import write_spikes
+from helpers.spike_ring import SpikeRing
+
+MAGIC = b'CNCCAP01'
+_HEAD = struct.Struct('<8sI')
+_CHUNK = struct.Struct('<III')
+
+
+class CaptureObserver(Observer):
+    """
+    timebase='source' stores the subject's timestamps (source_unit seconds each, 1e-6 for the hardware
+    listeners), 'arrival' the monotonic time the batch reached the observer. Either way the file holds integer
+    microseconds. The writer emits a chunk every flush_interval seconds or chunk_events events and fsyncs
+    every fsync_interval seconds.
+    """
+    def __init__(self, path, timebase='source', source_unit=1e-6, capacity=1 << 20, chunk_events=65536,
+                 flush_interval=0.25, fsync_interval=2.0, compression=1, metadata=None):
+        if timebase not in ('source', 'arrival'):
+            raise ValueError("timebase must be 'source' or 'arrival'")
+        self.path = path
+        self.timebase = timebase
+        self.scale = source_unit * 1e6
+        self.ring = SpikeRing(capacity)
+        self.chunk_events = chunk_events
+        self.flush_interval = flush_interval
+        self.fsync_interval = fsync_interval
+        self.compression = compression
+        self.events_written = 0
+        self.chunks = 0
+        self._last_ts = 0
+
+        meta = dict(metadata or {}, time_unit=1e-6, timebase=timebase, started=time.time())
+        meta = json.dumps(meta).encode('utf-8')
+        self._file = open(path, 'wb')
+        self._file.write(_HEAD.pack(MAGIC, len(meta)) + meta)
+        self._file.flush()
+        self._wakeup = threading.Event()
+        self.running = True
+        self.writer = threading.Thread(target=self._write_loop, daemon=True)
+        self.writer.start()
+
+    def update(self, subject: Subject):
+        stamp = getattr(subject, '_time', None)
+        self.update_batch(subject, None if stamp is None else (stamp,), (subject._event,))
+
+    def update_batch(self, subject: Subject, times, ids, velocities=None, durations=None):
+        if self.timebase == 'arrival' or times is None:
+            stamps = np.full(len(ids), time.monotonic() * 1e6)
+        else:
+            stamps = np.asarray(times, dtype=np.float64) * self.scale
+        self.ring.write(stamps, np.asarray(ids))
+        if len(self.ring) >= self.chunk_events:
+            self._wakeup.set()
+
+    @property
+    def overflow(self):
+        return self.ring.overflow
+
+    def stats(self):
+        return {'written': self.events_written, 'chunks': self.chunks, 'pending': len(self.ring),
+                'overflow': self.ring.overflow}
+
+    def _write_chunk(self, stamps, ids):
+        stamps = np.rint(stamps).astype('<i8')
+        # Deltas compress far better than absolute times, the first one is relative to the previous chunk
+        deltas = np.diff(stamps, prepend=self._last_ts)
+        self._last_ts = int(stamps[-1])
+        payload = zlib.compress(deltas.tobytes() + ids.astype('<i4').tobytes(), self.compression)
+        self._file.write(_CHUNK.pack(len(ids), len(payload), zlib.crc32(payload)) + payload)
+        self.events_written += len(ids)
+        self.chunks += 1
+
+    def _drain(self):
+        while len(self.ring):
+            stamps, ids = self.ring.read(self.chunk_events)
+            self._write_chunk(stamps, ids)
+        self._file.flush()
+
+    def _write_loop(self):
+        last_sync = time.monotonic()
+        while self.running:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+            if time.monotonic() - last_sync >= self.fsync_interval:
+                os.fsync(self._file.fileno())
+                last_sync = time.monotonic()
+
+    def close(self):
+        ''' Stop the writer, write what is left and close the file '''
+        if not self.running:
+            return
+        self.running = False
+        self._wakeup.set()
+        self.writer.join()
+        self._drain()
+        os.fsync(self._file.fileno())
+        self._file.close()
+
+    def cleanup(self):
+        self.close()
+
+
+def read_capture(path):
+    ''' (times, ids, metadata) of a capture, int64 microsecond times sorted, torn trailing chunk skipped '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    if len(data) < _HEAD.size:
+        raise ValueError(f"{path}: truncated header")
+    magic, meta_len = _HEAD.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError(f"{path}: not a Concerto capture")
+    metadata = json.loads(data[_HEAD.size:_HEAD.size + meta_len].decode('utf-8'))
+    offset = _HEAD.size + meta_len
+    deltas, ids = [], []
+    while offset + _CHUNK.size <= len(data):
+        n, size, crc = _CHUNK.unpack_from(data, offset)
+        payload = data[offset + _CHUNK.size:offset + _CHUNK.size + size]
+        if len(payload) < size or zlib.crc32(payload) != crc:
+            break
+        raw = zlib.decompress(payload)
+        deltas.append(np.frombuffer(raw, dtype='<i8', count=n))
+        ids.append(np.frombuffer(raw, dtype='<i4', count=n, offset=8 * n))
+        offset += _CHUNK.size + size
+    times = np.cumsum(np.concatenate(deltas)) if deltas else np.zeros(0, dtype=np.int64)
+    ids = np.concatenate(ids) if ids else np.zeros(0, dtype=np.int32)
+    if len(times) > 1 and np.any(times[1:] < times[:-1]):
+        order = np.argsort(times, kind='stable')
+        times, ids = times[order], ids[order]
+    return times, ids, metadata
+
+
+def capture_listener(path, **kwargs):
+    ''' NeuroListener replaying a capture with its original timing '''
+    times, ids, metadata = read_capture(path)
+    return NeuroListener(times, ids, time_unit=metadata.get('time_unit', 1e-6), **kwargs)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("usage: python -m helpers.capture session.cap out.spk")
+        sys.exit(1)
+    times, ids, metadata = read_capture(sys.argv[1])
+    write_spikes(sys.argv[2], times, ids, time_unit=metadata.get('time_unit', 1e-6), metadata=metadata)
+    print(f"Wrote {len(ids)} events to {sys.argv[2]}")
@@ -0,0 +1,158 @@
+"""
+Project: Concerto
+Description: asyncio variants of the pipeline, so one event loop (one thread) can host many listeners, generators
+            and control inputs. Waits are absolute loop.call_at deadlines instead of sleeping threads:
+                AsyncSubject            notifies observers whose update_batch may be a coroutine
+                AsyncNeuroListener      NeuroListener whose start_replay() is a coroutine
+                AsyncOrchestraGenerator OrchestraGenerator without worker thread, flushes run as loop callbacks
+
+                async def session(path, config, sink):
+                    listener = AsyncNeuroListener.from_recording(path)
+                    generator = AsyncOrchestraGenerator(config, sink=sink)
+                    listener.attach(generator)
+                    await listener.start_replay()
+                    generator.cleanup()
+
+                await asyncio.gather(session(a, config, sink_a), session(b, config, sink_b))
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import asyncio
+import inspect
+import time
+
+from helpers.concerto_classes import Subject, NeuroListener, OrchestraGenerator
+
+
+async def sleep_until(loop, deadline):
+    ''' Wait for the absolute loop time deadline '''
+    future = loop.create_future()
+    handle = loop.call_at(deadline, _resolve, future)
+    try:
+        await future
+    finally:
+        handle.cancel()
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+class AsyncSubject(Subject):
+    """
+    Subject for coroutines: notify_batch_async() awaits the observers whose update_batch is a coroutine
+    function, plain observers are called directly.
+    """
+    async def notify_batch_async(self, times, ids, velocities=None, durations=None) -> None:
+        tracer = self.tracer
+        traced = tracer is not None and tracer.sampled()
+        t0 = time.perf_counter()
+        start = (tracer.now() if traced else 0)
+        for observer in self._observers:
+            t_obs = (tracer.now() if traced else 0)
+            result = observer.update_batch(self, times, ids, velocities, durations)
+            if inspect.isawaitable(result):
+                await result
+            if traced:
+                tracer.record('update:' + type(observer).__name__, t_obs, events=len(ids))
+        if traced or self.stats is not None:
+            self._notified(traced, start, t0, len(ids))
+
+
+class AsyncNeuroListener(NeuroListener, AsyncSubject):
+    """
+    NeuroListener replaying on the event loop clock: every release of a tick's events waits for its absolute
+    deadline with loop.call_at, other tasks run meanwhile.
+    """
+    async def start_replay(self, speed=1.0, tick=0.001, chunk_size=4096):
+        """
+        Coroutine version of NeuroListener.start_replay, same schedule, arguments and returned stats.
+        speed=None still yields to the loop after every chunk.
+        """
+        schedule = self.replay_schedule(speed, tick, chunk_size)
+        loop = asyncio.get_running_loop()
+        self._streaming_flag = True
+        stats = self._reset_replay_stats()
+        start = loop.time()
+        for wake, due, batch in schedule:
+            drift = None
+            if wake is not None:
+                if wake > loop.time() - start:
+                    await sleep_until(loop, start + wake)
+                drift = loop.time() - start - due
+            await self.notify_batch_async(*batch)
+            self._count_release(len(batch[1]), drift)
+            if wake is None:
+                await asyncio.sleep(0)
+            if not self._streaming_flag:
+                break
+        return stats
+
+
+class AsyncOrchestraGenerator(OrchestraGenerator):
+    """
+    OrchestraGenerator driven by the event loop: enqueueing schedules a flush at most once per tick and the
+    next note off is a loop.call_at deadline, so no worker thread is needed. Create it inside the running loop
+    (or pass loop); updates from other threads are handed over to the loop thread.
+    """
+    def __init__(self, params, tick=0.001, loop=None, **kwargs):
+        self.loop = (loop if loop is not None else asyncio.get_running_loop())
+        kwargs.setdefault('clock', self.loop.time)
+        super().__init__(params, start_worker=False, **kwargs)
+        self.tick = tick
+        self._timer = None
+        self._last_flush = -tick
+
+    def update(self, subject: "Subject"):
+        super().update(subject)
+        self._schedule_soon()
+
+    def update_batch(self, subject: "Subject", times, ids, velocities=None, durations=None):
+        super().update_batch(subject, times, ids, velocities, durations)
+        self._schedule_soon()
+
+    def _schedule_soon(self):
+        try:
+            in_loop = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            in_loop = False
+        if in_loop:
+            self._schedule(self._last_flush + self.tick)
+        else:
+            self.loop.call_soon_threadsafe(self._schedule, self._last_flush + self.tick)
+
+    def _schedule(self, when):
+        # Keep the earliest pending wake up
+        if not self.running:
+            return
+        if self._timer is not None and not self._timer.cancelled() and self._timer.when() <= when:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = self.loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        if not self.running:
+            return
+        with self._wakeup:
+            pending = self.pending_notes.drain()
+        now = self.clock()
+        self._flush(pending, now)
+        self._last_flush = now
+        if self.pending_notes:
+            self._schedule(now + self.tick)
+        elif self.note_off_heap:
+            self._schedule(self.note_off_heap[0][0])
+
+    def cleanup(self):
+        self.running = False
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.sink.close()
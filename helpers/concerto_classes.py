@@ -15,12 +15,102 @@ from abc import ABC, abstractmethod
 from typing import List
 import yaml
 import time
-import rtmidi
-import queue
 import heapq
+import threading
+import numpy as np
+
+from helpers.spike_format import SpikeRecording, iter_merged
+from helpers.backpressure import Backpressure
+from helpers.midi_sinks import RtMidiSink, SharedSink
+from helpers.spike_ring import SpikeRing
+from helpers.stimulation import Stimulator, StimulationPlan
+from helpers.texel_cache import TexelParameterCache
 
 #from Samna_demo import chip_id
-from texel_api import *
+try:
+    from texel_api import *
+except ImportError:     # replay, rendering and benchmarks run without the Texel stack
+    texel_interface = None
+
+class NoteMap():
+    """
+    Neuron id -> (channel, note, velocity rule) compiled into dense arrays, so whole batches of ids are
+    mapped in one vectorized step. Unmapped ids (and ids beyond the table) have note -1.
+    Velocity rule per id: -1 keeps the event velocity, 0..127 overrides it (0 for silent ids).
+    """
+    def __init__(self, notes, channels=None, silent=(), velocity=None, name='map'):
+        self.name = name
+        self.has_channels = bool(channels)   # per-id channels declared, routed by OrchestraShards
+        ids = [self._check_id(k) for k in notes]
+        ids += [self._check_id(k) for k in (channels or {})]
+        ids += [self._check_id(k) for k in silent]
+        ids += [self._check_id(k) for k in (velocity or {})]
+        size = max(ids, default=-1) + 1
+        self.note = np.full(size, -1, dtype=np.int16)
+        self.channel = np.zeros(size, dtype=np.uint8)
+        self.velocity = np.full(size, -1, dtype=np.int16)
+        for k, v in notes.items():
+            self.note[int(k)] = self._check_range(v, 127, f"note of id {k}")
+        for k, v in (channels or {}).items():
+            self.channel[int(k)] = self._check_range(v, 15, f"channel of id {k}")
+        for k, v in (velocity or {}).items():
+            self.velocity[int(k)] = self._check_range(v, 127, f"velocity of id {k}")
+        for k in silent:
+            self.velocity[int(k)] = 0
+        self._notes_list = self.note.tolist()
+        self._velocity_list = self.velocity.tolist()
+
+    def _check_id(self, key):
+        if isinstance(key, bool) or not isinstance(key, (int, np.integer)) or key < 0:
+            raise ValueError(f"{self.name}: neuron id {key!r} is not a non-negative integer")
+        return int(key)
+
+    def _check_range(self, value, top, what):
+        if isinstance(value, bool) or not isinstance(value, (int, np.integer)) or not 0 <= value <= top:
+            raise ValueError(f"{self.name}: {what} must be an integer in 0..{top}, got {value!r}")
+        return int(value)
+
+    def __len__(self):
+        return len(self.note)
+
+    def populations(self):
+        '''
+        Populations are the groups of neurons sharing a target note. Returns (notes, population), notes sorted
+        and population[id] the index into notes (-1 for unmapped ids).
+        '''
+        notes = np.unique(self.note[self.note >= 0])
+        population = np.full(len(self.note), -1, dtype=np.int16)
+        mapped = self.note >= 0
+        population[mapped] = np.searchsorted(notes, self.note[mapped])
+        return notes.tolist(), population
+
+    def lookup(self, id, velocity=100):
+        ''' (note, velocity) of a single neuron id, note -1 if unmapped '''
+        if not 0 <= id < len(self._notes_list):
+            return -1, velocity
+        rule = self._velocity_list[id]
+        return self._notes_list[id], (velocity if rule < 0 else rule)
+
+    def map_batch(self, ids, velocities=None, default_velocity=100):
+        '''
+        Map a batch of neuron ids. Returns (channels, notes, velocities, mapped) arrays over the input;
+        `mapped` is False for unmapped ids, whose entries are meaningless.
+        '''
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.note):
+            # Empty map: every id is unmapped
+            unmapped = np.zeros(len(ids), dtype=np.int16)
+            return unmapped.astype(np.uint8), unmapped - 1, unmapped, np.zeros(len(ids), dtype=bool)
+        inside = (ids >= 0) & (ids < len(self.note))
+        safe = np.where(inside, ids, 0)
+        notes = np.where(inside, self.note[safe], -1)
+        mapped = notes >= 0
+        rule = self.velocity[safe]
+        if velocities is None:
+            velocities = np.full(len(ids), default_velocity, dtype=np.int16)
+        velocities = np.where(rule >= 0, rule, np.clip(velocities, 0, 127))
+        return self.channel[safe], notes, velocities, mapped
+
 
 class Config():
     def __init__(self,filename, attribute):
@@ -28,11 +118,23 @@ class Config():
             params = yaml.safe_load(f)
         self.params_dict = params[attribute]
         self.fill_parameters()
+        self.compile()
 
     def fill_parameters(self):
         for key, value in self.params_dict.items():
             setattr(self, key, value)
 
+    def compile(self):
+        ''' Validate the id/population maps once and build their lookup tables (self.note_maps) '''
+        silent = self.params_dict.get('silent') or ()
+        velocity = self.params_dict.get('velocity') or {}
+        channels = self.params_dict.get('channel') or {}
+        self.note_maps = {}
+        for name in ('id', 'population'):
+            if name in self.params_dict:
+                self.note_maps[name] = NoteMap(self.params_dict[name] or {}, channels, silent, velocity, name=name)
+        return self.note_maps
+
 
 class Subject(ABC):
     """
@@ -40,6 +142,8 @@ class Subject(ABC):
     """
     def __init__(self):
         self._observers: List[Observer] = []
+        self.stats = None   # PipelineStats (helpers/instrumentation.py) when enabled
+        self.tracer = None  # Tracer (helpers/tracing.py) when enabled
     def attach(self, observer: Observer) -> None:
         print("Subject: Attached an observer.")
         self._observers.append(observer)
@@ -52,8 +156,77 @@ class Subject(ABC):
         """
         Trigger an update in each subscriber.
         """
-        for observer in self._observers:
-            observer.update(self)
+        stats = self.stats
+        tracer = self.tracer
+        traced = tracer is not None and tracer.sampled()
+        if stats is None and not traced:
+            for observer in self._observers:
+                observer.update(self)
+            return
+        t0 = time.perf_counter()
+        start = 0
+        if not traced:
+            for observer in self._observers:
+                observer.update(self)
+        else:
+            start = tracer.now()
+            for observer in self._observers:
+                t_obs = tracer.now()
+                observer.update(self)
+                tracer.record('update:' + type(observer).__name__, t_obs)
+        self._notified(traced, start, t0, 1)
+
+    def notify_batch(self, times, ids, velocities=None, durations=None) -> None:
+        """
+        Publish a whole chunk of events to each subscriber in one call.
+        times, ids, velocities and durations are aligned sequences (velocities/durations optional).
+        """
+        stats = self.stats
+        tracer = self.tracer
+        traced = tracer is not None and tracer.sampled()
+        if stats is None and not traced:
+            for observer in self._observers:
+                observer.update_batch(self, times, ids, velocities, durations)
+            return
+        t0 = time.perf_counter()
+        start = 0
+        if not traced:
+            for observer in self._observers:
+                observer.update_batch(self, times, ids, velocities, durations)
+        else:
+            start = tracer.now()
+            for observer in self._observers:
+                t_obs = tracer.now()
+                observer.update_batch(self, times, ids, velocities, durations)
+                tracer.record('update:' + type(observer).__name__, t_obs, events=len(ids))
+        self._notified(traced, start, t0, len(ids))
+
+    def _notified(self, traced, start, t0, n) -> None:
+        # End of an instrumented notify: the sampled notify span (tracer clock start) and the stats (t0)
+        if traced:
+            self.tracer.record('notify', start, events=n)
+        stats = self.stats
+        if stats is not None:
+            stats.observe('notify', time.perf_counter() - t0)
+            stats.count('notified', n)
+
+class SpikeEvent():
+    """
+    Single event view handed to Observer.update() when a batch is unrolled, so the per-event state
+    does not live on the (shared) subject. Unset attributes fall back to the observer defaults.
+    _time is the event timestamp, in the subject's time unit.
+    """
+    __slots__ = ('subject', '_event', '_duration', '_velocity', '_time')
+
+    def __init__(self, subject, event, duration=None, velocity=None, time=None):
+        self.subject = subject
+        self._event = event
+        if time is not None:
+            self._time = time
+        if duration is not None:
+            self._duration = duration
+        if velocity is not None:
+            self._velocity = velocity
 
 class Observer(ABC):
     """
@@ -66,17 +239,43 @@ class Observer(ABC):
         """
         pass
 
+    def update_batch(self, subject: Subject, times, ids, velocities=None, durations=None) -> None:
+        """
+        Receive a chunk of events from subject. Fallback: one update() per event.
+        """
+        for k, id in enumerate(ids):
+            self.update(SpikeEvent(subject, id,
+                                   None if durations is None else durations[k],
+                                   None if velocities is None else velocities[k],
+                                   None if times is None else times[k]))
+
 class NeuroListener(Subject):
     ''' Dummy class with list of events times and ids '''
-    def __init__(self, times, ids, delay=0.005, default_velocity=100):
+    def __init__(self, times, ids, delay=0.005, default_velocity=100, time_unit=1e-6):
         super().__init__()
         self.times = times
         self.ids = ids
         self._event = None
         self.delay_streaming = delay
         self.default_velocity = default_velocity
-        self.silent_notes = [i for i in range(65,81)]
+        self.silent_notes = {i for i in range(65,81)}
         self.silent_velocity = 0
+        self._silent_lut = (None, None)   # (silent_notes it was built from, boolean table)
+        self.time_unit = time_unit    # seconds per timestamp unit (1e-6 for us, 1.0 for s)
+        self._streaming_flag = True
+        self.replay_stats = {}
+        self._chunk_source = None
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        ''' Listener streaming a columnar recording (helpers/spike_format.py) from its memory map '''
+        rec = SpikeRecording(path)
+        return cls(rec.times, rec.ids, time_unit=rec.time_unit, **kwargs)
+    @classmethod
+    def from_populations(cls, ts_lists, id_lists, chunk_size=4096, **kwargs):
+        ''' Listener replaying per-population spike trains through a lazy k-way merge (one replay only) '''
+        listener = cls([], [], **kwargs)
+        listener._chunk_source = ((t, i) for t, i, _ in iter_merged(ts_lists, id_lists, chunk_size))
+        return listener
     def setup(self):
         ''' Setup the port to connect '''
         pass
@@ -86,45 +285,264 @@ class NeuroListener(Subject):
     def start_event_listener(self):
         ''' Class to fill per Hardware platform inherited'''
         pass
+    def stop_listener(self):
+        self._streaming_flag = False
     def start_streaming_events(self):
         tm1 = self.times[0]
         for t,id in zip(self.times, self.ids):
             #time.sleep() preproccess the alld diff= t -(t-1) before hand does sleep work at ms?
             self._event = id
+            self._time = t
             self._duration = (t-tm1)/1000000
             self._velocity = ( self.silent_velocity if id in self.silent_notes else self.default_velocity)
             self.notify()
             tm1 = t
             time.sleep(self.delay_streaming)
 
-class NeuroListener_Texel(Subject):
+    def _iter_chunks(self, chunk_size):
+        if self._chunk_source is not None:
+            yield from self._chunk_source
+            return
+        for k in range(0, len(self.times), chunk_size):
+            yield self.times[k:k + chunk_size], self.ids[k:k + chunk_size]
+
+    def _velocities(self, ids):
+        source, lut = self._silent_lut
+        if source is not self.silent_notes:
+            lut = np.zeros(max(self.silent_notes, default=-1) + 2, dtype=bool)
+            lut[list(self.silent_notes)] = True
+            self._silent_lut = (self.silent_notes, lut)
+        silent = lut[np.clip(ids, 0, len(lut) - 1)] & (ids >= 0)
+        return np.where(silent, self.silent_velocity, self.default_velocity)
+
+    def iter_batches(self, chunk_size=4096):
+        """
+        Yield the recording as (timestamps, ids, velocities, durations, offsets) array chunks, offsets in
+        seconds from the first event. Shared by the live replay and the offline renderer.
+        """
+        t0 = prev = None
+        for ts, ids in self._iter_chunks(chunk_size):
+            ts = np.asarray(ts, dtype=np.float64)
+            ids = np.asarray(ids)
+            if len(ts) == 0:
+                continue
+            if t0 is None:
+                t0 = prev = ts[0]
+            durations = np.diff(ts, prepend=prev) * self.time_unit
+            prev = ts[-1]
+            yield ts, ids, self._velocities(ids), durations, (ts - t0) * self.time_unit
+
+    def replay_schedule(self, speed=1.0, tick=0.001, chunk_size=4096):
+        """
+        Release schedule of the replay, shared by the thread and asyncio replays. Yields (wake, due, batch):
+        wake the release time in seconds from the replay start, due the deadline of the batch's first event
+        and batch the (timestamps, ids, velocities, durations) due by wake. Releases are at least one tick
+        apart, events due meanwhile form one batch. speed=None yields one batch per chunk, wake and due None.
+        """
+        if speed is not None and speed <= 0:
+            raise ValueError("speed must be > 0 or None")
+        last_release = -tick
+        for ts, ids, velocities, durations, offsets in self.iter_batches(chunk_size):
+            if speed is None:
+                yield None, None, (ts, ids, velocities, durations)
+                continue
+            deadlines = offsets / speed
+            i, n = 0, len(ids)
+            while i < n:
+                # Never wake more often than once per tick
+                wake = max(float(deadlines[i]), last_release + tick)
+                j = int(np.searchsorted(deadlines, wake, side='right'))
+                yield wake, float(deadlines[i]), (ts[i:j], ids[i:j], velocities[i:j], durations[i:j])
+                last_release = wake
+                i = j
+
+    def _reset_replay_stats(self):
+        self.replay_stats = {'events': 0, 'batches': 0, 'drift_last': 0.0, 'drift_max': 0.0, 'drift_mean': 0.0}
+        return self.replay_stats
+
+    def _count_release(self, n, drift=None):
+        # One released batch of n events, drift = release time - deadline of its first event
+        stats = self.replay_stats
+        stats['events'] += n
+        stats['batches'] += 1
+        if drift is not None:
+            stats['drift_last'] = drift
+            stats['drift_max'] = max(stats['drift_max'], drift)
+            stats['drift_mean'] += (drift - stats['drift_mean']) / stats['batches']
+
+    def start_replay(self, speed=1.0, tick=0.001, chunk_size=4096):
+        """
+        Replay the recording against absolute monotonic deadlines computed from the timestamps
+        (times must be sorted). speed scales the recording clock (0.1 = ten times slower),
+        speed=None replays as fast as possible. All events due within one tick go out as one
+        notify_batch(). Lateness against the schedule is kept in self.replay_stats.
+        """
+        schedule = self.replay_schedule(speed, tick, chunk_size)
+        self._streaming_flag = True
+        stats = self._reset_replay_stats()
+        start = time.monotonic()
+        for wake, due, batch in schedule:
+            drift = None
+            if wake is not None:
+                now = time.monotonic() - start
+                if wake > now:
+                    time.sleep(wake - now)
+                    now = time.monotonic() - start
+                drift = now - due
+            self.notify_batch(*batch)
+            self._count_release(len(batch[1]), drift)
+            if not self._streaming_flag:
+                break
+        return stats
+
+class BufferedListener(Subject):
     """
-    SensorStatus is a Subject node that notifies the status of each of the sensors for motor control and logging
+    Base of the hardware listeners. A reader thread (subclass _read_loop) drains the device into self.ring
+    with _publish(), a dispatcher thread hands ring chunks to the observers, so a slow observer only fills
+    the ring (overflow is counted, see reader_stats) and never stalls the device read.
     """
-    def __init__(self, parameters, flags, core, neuron_list):
+    def __init__(self, ring_capacity=1 << 16, max_chunk=4096, ring=None):
         super().__init__()
+        # Reader thread -> dispatcher thread (or another process when a shared memory ring is given)
+        self.ring = (ring if ring is not None else SpikeRing(ring_capacity))
+        self.max_chunk = max_chunk
+        self._data_ready = threading.Event()
+        self.reader = None
+        self.dispatcher = None
+        self._reads = 0
+        self._events_read = 0
+        self._dispatched = 0
+        self._streaming_flag = True
+        self._reader_done = False
+
+    @abstractmethod
+    def _read_loop(self) -> None:
+        """
+        Read the device with _publish() until _streaming_flag is cleared.
+        """
+        pass
+
+    def _start_threads(self, dispatch=True, blocking=False):
+        self._streaming_flag = True
+        self._reader_done = False
+        self.reader = threading.Thread(target=self._read_loop, daemon=True)
+        self.reader.start()
+        if dispatch:
+            self.dispatcher = threading.Thread(target=self._dispatch_loop, daemon=True)
+            self.dispatcher.start()
+        if blocking:
+            (self.dispatcher or self.reader).join()
+
+    def _publish(self, s_ts, s_id):
+        self._reads += 1
+        self._events_read += len(s_id)
+        self.ring.write(s_ts, s_id)
+        self._data_ready.set()
+
+    def _dispatch_loop(self):
+        while True:
+            self._data_ready.wait()
+            self._data_ready.clear()
+            # Read before draining: once the reader is done, this drain sees its last write
+            finished = self._reader_done
+            while True:
+                s_ts, s_id = self.ring.read(self.max_chunk)
+                if not len(s_id):
+                    break
+                # One call per read chunk instead of one notify() per event
+                self.notify_batch(s_ts, s_id)
+                self._dispatched += len(s_id)
+            if finished:
+                return
+
+    def reader_stats(self):
+        ''' Hardware read counters: reads with data, events read, events dispatched, pending and overflowed '''
+        return {'reads': self._reads, 'events_read': self._events_read, 'dispatched': self._dispatched,
+                'pending': len(self.ring), 'overflow': self.ring.overflow}
+
+    def _stop_threads(self):
+        self._streaming_flag = False
+        # The reader's last read has to be in the ring before the dispatcher drains it for the last time
+        if self.reader is not None:
+            self.reader.join()
+        self._reader_done = True
+        self._data_ready.set()
+        if self.dispatcher is not None:
+            self.dispatcher.join()
+        self.reader = self.dispatcher = None
+
+# Biases of the sample network (core 0)
+SAMPLE_PARAMETERS = {
+    "neuron_ref_NFI": 100e-12,
+    "neuron_gain_NFI": 2e-12,
+    "neuron_starve_NFI": 1e-9,
+    "neuron_spkthr_PFI": 10e-9,
+    "neuron_tau_NFI": 10e-12,
+    'ssynapse_w_NFI': 100e-9,  # exc
+    'ssynapse_w_PFI': 1e-9,  # inh
+    'static_exc_gain_PFI': 1e-12,
+    'static_exc_tau_PFI': 1e-12,
+    'static_inh_gain_NFI': 1e-12,
+    'static_inh_tau_NFI': 1e-12,
+    'plastic_right_tau_PFI': 1e-12,
+    'plastic_right_gain_PFI': 1e-12,
+    'bypass_tail_w1_NFI': 100e-9,
+    'ahp_pw_PFI': 1e-9,  # used to control post-pulse width
+    'pw_read_pot_PFI': 1e-9,  # used to control pre-pulse width
+}
+
+class NeuroListener_Texel(BufferedListener):
+    """
+    SensorStatus is a Subject node that notifies the status of each of the sensors for motor control and logging
+    """
+    def __init__(self, parameters, flags, core, neuron_list, ring_capacity=1 << 16, max_chunk=4096, idle_wait=0.001,
+                 stim_rate=100.0, stim_tick=0.002, stim_max_batch=64, warm_start=False, cache_path=None,
+                 ring=None):
+        super().__init__(ring_capacity, max_chunk, ring)
         self.chip = texel_interface(parameters=parameters, flags=flags, serial_port='/dev/ttyACM0')
+        # The chip mirror is only persisted for warm starts
+        if warm_start and cache_path is None:
+            cache_path = '.texel_cache.json'
+        self.param_cache = TexelParameterCache(parameters, flags, path=cache_path)
+        self.idle_wait = idle_wait
         self.core = core
         self.n_list = neuron_list
-        self.clean()
+        # Serial link shared by the reader, the stimulator and parameter updates, one holder per transaction
+        self._chip_lock = threading.Lock()
+        if warm_start and self.param_cache.load():
+            # Chip still holds the cached state: open the link, skip reset and register rewrite
+            self.chip.setup()
+        else:
+            self.clean()
         self.setup_sample_parameters()
-        self.stimulator = threading.Thread(target=self._send_spikes, daemon=True)
+        self.stimulator = Stimulator(self._send_spikes, tick=stim_tick, max_batch=stim_max_batch)
+        self.stim_rate = stim_rate
         self._streaming_flag = True
 
-    def _send_spikes(self):
-        while True:
-            for neuron_id in self.neulist:
-                for i in range(10):
-    #                if random.random() < 0.5:
-                    self.chip.send_spike(core=self.core, neuron_idx=neuron_id, synapse_idx=(0))
-                    self.chip.send_spike(core=self.core, neuron_idx=neuron_id, synapse_idx=(0))
+    def _send_spikes(self, neurons):
+        tracer = self.tracer
+        start = (tracer.now() if tracer is not None else 0)
+        with self._chip_lock:
+            for neuron_id in neurons.tolist():
+                self.chip.send_spike(core=self.core, neuron_idx=neuron_id, synapse_idx=(0))
+        if tracer is not None and tracer.sampled():
+            tracer.record('stimulate', start, spikes=len(neurons))
+
+    def _stimulation_plan(self, neuron_list, rate, mode, seed):
+        rate = (self.stim_rate if rate is None else rate)
+        if np.ndim(rate):
+            return StimulationPlan(dict(zip(neuron_list, rate)), mode=mode, seed=seed)
+        return StimulationPlan.uniform(neuron_list, rate, mode=mode, seed=seed)
 
-    def start_stimulation(self, neuron_list):
+    def start_stimulation(self, neuron_list, rate=None, mode='poisson', seed=None):
+        ''' Stimulate neuron_list at rate Hz (one rate or one per neuron), Poisson or regular trains '''
         self.n_list = neuron_list
-        self.stimulator.start()
+        self.stimulator.start(self._stimulation_plan(neuron_list, rate, mode, seed))
 
-    def stimulate(self, neuron_list):
+    def stimulate(self, neuron_list, rate=None, mode='poisson', seed=None):
+        ''' Switch the running stimulation to a new neuron set / rates '''
         self.n_list = neuron_list
+        self.stimulator.set_plan(self._stimulation_plan(neuron_list, rate, mode, seed))
 
     def clean(self):
         # Reset Chip
@@ -134,147 +552,604 @@ class NeuroListener_Texel(Subject):
         self.chip.write_all_registers()
         self.chip.reset(which='synapses')
         time.sleep(1)
+        self.param_cache.reset()
 
     def setup_sample_parameters(self):
-        for n in self.n_list:
-            self.chip.activate_neuron_monitor(core=0, neuron_idx=n)
-            self.chip.activate_synapse_monitor(core=0, neuron_idx=n, synapse_idx=0)
+        with self._chip_lock:
+            added = self.param_cache.activate_monitors(self.chip, self.n_list)
+            snapshot = (self.param_cache.snapshot() if added else None)
+        if added:
+            self.param_cache.write(snapshot)
         self.sample_parameter_network(self.n_list)
 
-    def start_event_listener(self, debug=False) -> None:
+    def set_parameters(self, values, core=0):
+        ''' Bias updates {name: value}, only the changed ones are sent. Returns how many changed '''
+        with self._chip_lock:
+            changed = self.param_cache.update_parameters(self.chip, values, core=core)
+            snapshot = (self.param_cache.snapshot() if changed else None)
+        # Disk write after the serial link is released
+        if changed:
+            self.param_cache.write(snapshot)
+        return changed
+
+    def set_weights(self, weights, core=0):
+        ''' Synapse 0 weights {neuron: value}, only the changed ones are sent. Returns how many changed '''
+        with self._chip_lock:
+            changed = self.param_cache.set_weights(self.chip, weights, core=core)
+            snapshot = (self.param_cache.snapshot() if changed else None)
+        if changed:
+            self.param_cache.write(snapshot)
+        return changed
+
+    def start_event_listener(self, debug=False, blocking=False, dispatch=True) -> None:
         """
-        Loop to read events
+        Start the experiment and two threads: the reader drains the device into self.ring as fast as the
+        link delivers, the dispatcher hands ring chunks to the observers. A slow observer only fills the
+        ring (overflow is counted, see reader_stats) and never stalls the serial read.
+        dispatch=False starts the reader only, the ring is consumed elsewhere (see helpers.acquisition).
+        Returns immediately unless blocking is set.
         """
-        tm1 = 0
         self.chip.start_experiment()
+        self._start_threads(dispatch, blocking)
+
+    def _read_loop(self):
         while self._streaming_flag:
-            time.sleep(0.001)
-            s_ts, s_id = self.chip.report_neural_activity()
+            stats = self.stats
+            tracer = self.tracer
+            if stats is None and tracer is None:
+                with self._chip_lock:
+                    s_ts, s_id = self.chip.report_neural_activity()
+            else:
+                t0 = time.perf_counter_ns()
+                with self._chip_lock:
+                    s_ts, s_id = self.chip.report_neural_activity()
+                n = (len(s_ts) if s_ts else 0)
+                if stats is not None:
+                    stats.observe('read', (time.perf_counter_ns() - t0) * 1e-9)
+                    stats.count('read_events', n)
+                if tracer is not None and tracer.sampled():
+                    tracer.record('read', t0, events=n)
             if not s_ts:
+                # Back off only while the device has nothing for us
+                time.sleep(self.idle_wait)
                 continue
-            for ts,id in zip(s_ts, s_id):
-                self._event = id
-                # self._duration = ((ts-tm1)/1000000 if tm1!=0 else 0)
-                self.notify()
-                tm1 = ts
-            #time.sleep(0.005)
-
+            self._publish(s_ts, s_id)
+        self._data_ready.set()
 
     def sample_parameter_network(self, neuron_list):
-        self.chip.update_parameter(core=0, param="neuron_ref_NFI", value=100e-12)
-        self.chip.update_parameter(core=0, param="neuron_gain_NFI", value=2e-12)
-        self.chip.update_parameter(core=0, param="neuron_starve_NFI", value=1e-9)
-        self.chip.update_parameter(core=0, param="neuron_spkthr_PFI", value=10e-9)
-        self.chip.update_parameter(core=0, param="neuron_tau_NFI", value=10e-12)
-        self.chip.update_parameter(core=0, param='ssynapse_w_NFI', value=100e-9)  # exc
-        self.chip.update_parameter(core=0, param='ssynapse_w_PFI', value=1e-9)  # inh
-        self.chip.update_parameter(core=0, param='static_exc_gain_PFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='static_exc_tau_PFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='static_inh_gain_NFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='static_inh_tau_NFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='plastic_right_tau_PFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='plastic_right_gain_PFI', value=1e-12)
-        self.chip.update_parameter(core=0, param='bypass_tail_w1_NFI', value=100e-9)
-        self.chip.update_parameter(core=0, param='ahp_pw_PFI', value=1e-9)  # used to control post-pulse width
-        self.chip.update_parameter(core=0, param='pw_read_pot_PFI', value=1e-9)  # used to control pre-pulse width
-        for neuron in neuron_list:
-            self.chip.set_synapse_weight(core=0, neuron_idx=neuron, synapse_idx=(0), value=1)
+        self.set_parameters(SAMPLE_PARAMETERS)
+        self.set_weights({neuron: 1 for neuron in neuron_list})
         #self.chip.set_synapse_weight(core=0, neuron_idx=0, synapse_idx=(0), value=1)
 
 
     def stop_listener(self):
-        self._streaming_flag = False
+        self.stimulator.stop()
+        self._stop_threads()
         self.chip.uC.stop_experiment()
 
+class NeuroListener_Dynapse(BufferedListener):
+    """
+    DYNAP-SE (samna) listener. sink_node is the samna buffer sink of the event graph (or a stand-in, see
+    helpers/dynapse_sim.py); events carry timestamp (us), chip_id, core_id and neuron_id.
+    (chip, core, neuron) addresses become compact ids: the position in monitored_neurons when given (other
+    neurons are counted as unmapped), chip * 1024 + core * 256 + neuron otherwise.
+    The reader takes whole get_events() batches and adapts its wait so a read holds about target_batch
+    events, between min_wait and max_wait.
+    """
+    CHIPS, CORES, NEURONS = 4, 4, 256
+
+    def __init__(self, sink_node, monitored_neurons=None, ring_capacity=1 << 16, max_chunk=4096, target_batch=256,
+                 min_wait=0.0005, max_wait=0.02, ring=None):
+        super().__init__(ring_capacity, max_chunk, ring)
+        self.sink_node = sink_node
+        self.target_batch = target_batch
+        self.min_wait = min_wait
+        self.max_wait = max_wait
+        self.wait = max_wait
+        self._unmapped = 0
+        # Flat address -> compact id, -1 for neurons that are not monitored
+        size = self.CHIPS * self.CORES * self.NEURONS
+        if monitored_neurons is None:
+            self.id_lut = np.arange(size, dtype=np.int32)
+        else:
+            self.id_lut = np.full(size, -1, dtype=np.int32)
+            for k, (chip, core, neuron) in enumerate(monitored_neurons):
+                self.id_lut[self.address(chip, core, neuron)] = k
+        self.monitored_neurons = monitored_neurons
+
+    @classmethod
+    def address(cls, chip, core, neuron):
+        return (chip * cls.CORES + core) * cls.NEURONS + neuron
+
+    def neuron_of(self, id):
+        ''' (chip, core, neuron) of a compact id '''
+        if self.monitored_neurons is not None:
+            return tuple(self.monitored_neurons[id])
+        chip_core, neuron = divmod(int(id), self.NEURONS)
+        return divmod(chip_core, self.CORES) + (neuron,)
+
+    def _convert(self, events):
+        records = np.array([(e.timestamp, e.chip_id, e.core_id, e.neuron_id) for e in events], dtype=np.int64)
+        s_ts = records[:, 0]
+        flat = (records[:, 1] * self.CORES + records[:, 2]) * self.NEURONS + records[:, 3]
+        inside = (flat >= 0) & (flat < len(self.id_lut))
+        s_id = self.id_lut[np.where(inside, flat, 0)]
+        mapped = inside & (s_id >= 0)
+        unmapped = len(s_id) - int(np.count_nonzero(mapped))
+        if unmapped:
+            self._unmapped += unmapped
+            s_ts, s_id = s_ts[mapped], s_id[mapped]
+        return s_ts, s_id
+
+    def _adapt_wait(self, n):
+        # Aim for target_batch events per read: shorter waits as the rate grows, doubling while idle
+        if n == 0:
+            self.wait = min(self.max_wait, self.wait * 2)
+        else:
+            self.wait = min(self.max_wait, max(self.min_wait, self.wait * self.target_batch / n))
+
+    def _read_loop(self):
+        while self._streaming_flag:
+            stats = self.stats
+            tracer = self.tracer
+            t0 = time.perf_counter()
+            start = (tracer.now() if tracer is not None else 0)
+            events = self.sink_node.get_events()
+            if tracer is not None and tracer.sampled():
+                tracer.record('read', start, events=len(events))
+            if stats is not None:
+                stats.observe('read', time.perf_counter() - t0)
+                stats.count('read_events', len(events))
+            self._adapt_wait(len(events))
+            if len(events):
+                s_ts, s_id = self._convert(events)
+                if len(s_id):
+                    self._publish(s_ts, s_id)
+            time.sleep(self.wait)
+        self._data_ready.set()
+
+    def start_event_listener(self, blocking=False, dispatch=True) -> None:
+        ''' Clear the sink buffer and start the reader and dispatcher threads, returns immediately unless blocking '''
+        self.sink_node.get_events()
+        self._start_threads(dispatch, blocking)
+
+    def reader_stats(self):
+        stats = super().reader_stats()
+        stats['unmapped'] = self._unmapped
+        stats['wait'] = self.wait
+        return stats
+
+    def stop_listener(self):
+        self._stop_threads()
+
 ''' OBSERVERS - Midi Generator '''
+class PendingNoteTable():
+    """
+    Latest pending event per MIDI note in 128 preallocated slots. A dirty mask and a ring of dirty
+    notes (in first-arrival order) replace the dict + marker queue: each note is queued at most once,
+    so memory stays O(1) per note and nothing is allocated per spike. Callers hold the generator lock.
+    """
+    SIZE = 128
+
+    def __init__(self):
+        self.duration = [0.0] * self.SIZE
+        self.velocity = [0] * self.SIZE
+        self.enqueued = [0.0] * self.SIZE
+        self.dirty = bytearray(self.SIZE)
+        self._ring = [0] * self.SIZE
+        self._head = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, note, duration, velocity, enqueued):
+        ''' Store/replace the pending event of note, queue it if it was not dirty yet (returns False when coalesced) '''
+        self.duration[note] = duration
+        self.velocity[note] = velocity
+        self.enqueued[note] = enqueued
+        if self.dirty[note]:
+            return False
+        self.dirty[note] = 1
+        self._ring[(self._head + self._count) % self.SIZE] = note
+        self._count += 1
+        return True
+
+    def notes(self):
+        ''' Dirty notes, oldest first '''
+        return [self._ring[(self._head + k) % self.SIZE] for k in range(self._count)]
+
+    def pop_oldest(self):
+        note = self._ring[self._head]
+        self._head = (self._head + 1) % self.SIZE
+        self._count -= 1
+        self.dirty[note] = 0
+        return note
+
+    def remove(self, note):
+        ''' Drop the pending event of an arbitrary note, O(pending) '''
+        if not self.dirty[note]:
+            return
+        remaining = [n for n in self.notes() if n != note]
+        self.dirty[note] = 0
+        self._head = 0
+        self._count = len(remaining)
+        self._ring[:self._count] = remaining
+
+    def drain(self):
+        ''' Pop every pending event as (note, duration, velocity, enqueued), oldest first '''
+        events = []
+        for _ in range(self._count):
+            note = self._ring[self._head]
+            self._head = (self._head + 1) % self.SIZE
+            self.dirty[note] = 0
+            events.append((note, self.duration[note], self.velocity[note], self.enqueued[note]))
+        self._count = 0
+        return events
+
 class OrchestraGenerator(Observer):
-    def __init__(self, params, population=False, debug=False, default_duration=0.001, default_velocity=100, max_queue=500):
+    def __init__(self, params, population=False, debug=False, default_duration=0.001, default_velocity=100, max_queue=500,
+                 policy=None, target_latency=0.005, channel=None, retrigger=True, stats=None, sink=None,
+                 clock=time.monotonic, start_worker=True):
         self.debug = debug
+        self.stats = stats   # PipelineStats (helpers/instrumentation.py) when enabled
+        self.tracer = None   # Tracer (helpers/tracing.py) when enabled
+        self.note_map = params.note_maps['population' if population else 'id']
+        if channel is None:
+            channel = 0
+            if self.note_map.has_channels:
+                print("OrchestraGenerator: one generator plays on one channel, the per-id channels of the config "
+                      "are ignored. Use OrchestraShards to route them.")
+        self.channel = channel
+        self.retrigger = retrigger   # re-send note on for a sounding note, otherwise only extend it
         self.notes_id = (params.id if not population else params.population)
         self.params_dict = params.params_dict
         self.default_duration = default_duration
         self.default_velocity = default_velocity
         self.max_queue = max_queue
+        self.clock = clock   # monotonic seconds, virtual when rendering offline
 
-        self.midiout = rtmidi.MidiOut()
-        self.setup_midi_comm(0)
+        # MIDI output (helpers/midi_sinks.py), rtmidi port 0 by default
+        self.sink = (sink if sink is not None else RtMidiSink(0))
+        # Pre-encoded messages reused for every send, note ons are filled in on first use
+        self._note_off_msgs = [(0x80 | channel, n, 0) for n in range(128)]
+        self._note_on_msgs = [None] * (128 * 128)
+        self._batch = []
 
-        # Deduplication: only latest per note_id
-        self.event_queue = queue.Queue()
-        self.pending_notes = {}   # note_id -> (note_id, duration, velocity)
-        self.note_off_heap = []   # (timestamp, note_id)
+        # Deduplication: only latest per note_id, the worker sleeps on the condition until
+        # a note is pending or the earliest note off is due
+        self._wakeup = threading.Condition()
+        self.pending_notes = PendingNoteTable()
+        # Admission limit follows the measured MIDI drain rate, policy picks what is dropped
+        self.backpressure = Backpressure(policy, max_pending=max_queue, target_latency=target_latency)
+        # Active notes, worker thread only: one pending note off per note of this channel. Heap entries
+        # are invalidated lazily, a popped entry whose note was extended is pushed again
+        self.note_off_heap = []   # (deadline, note_id)
+        self.off_deadline = [0.0] * 128   # 0.0 = not sounding
+        self._in_heap = bytearray(128)
+        self.retriggers = 0
         self.running = True
+        self._timing = {'note_on': [0, 0.0, 0.0], 'note_off': [0, 0.0, 0.0]}  # count, sum, max error
 
-        # Worker thread
-        self.worker = threading.Thread(target=self._player_loop, daemon=True)
-        self.worker.start()
-
-    def setup_midi_comm(self, port_id):
-        available_ports = self.midiout.get_ports()
-        if available_ports:
-            self.midiout.open_port(port_id)
-        else:
-            self.midiout.open_virtual_port("My virtual output")
+        # Worker thread, offline rendering drives _flush() itself
+        self.worker = None
+        if start_worker:
+            self.worker = threading.Thread(target=self._player_loop, daemon=True)
+            self.worker.start()
 
     def cleanup(self):
-        self.running = False
-        self.worker.join()
-        if self.midiout.is_port_open():
-            self.midiout.close_port()
-        del self.midiout
+        with self._wakeup:
+            self.running = False
+            self._wakeup.notify()
+        if self.worker is not None:
+            self.worker.join()
+        self.sink.close()
 
     def silence(self):
         """All notes off (MIDI CC 123)."""
-        self.midiout.send_message([0xB0, 123, 0])
+        self.sink.send_message((0xB0 | self.channel, 123, 0))
+
+    def drop_stats(self):
+        """Admission limit, measured drain/arrival rates and drops per policy."""
+        with self._wakeup:
+            return self.backpressure.stats()
+
+    def timing_stats(self):
+        """Measured note-on latency (enqueue to send) and note-off lateness (send vs deadline), in seconds."""
+        stats = {}
+        for kind, (count, total, worst) in self._timing.items():
+            stats[kind] = {'count': count, 'mean': (total / count if count else 0.0), 'max': worst}
+        return stats
+
+    def _record_timing(self, kind, error):
+        entry = self._timing[kind]
+        entry[0] += 1
+        entry[1] += error
+        if error > entry[2]:
+            entry[2] = error
 
     def update(self, subject: "Subject"):
         """Observer callback: enqueue latest event (note, duration, velocity)."""
         #print(subject._event)
 
-        note_id = self.notes_id[subject._event]
         duration = getattr(subject, "_duration", self.default_duration)
         #duration = self.default_duration
         velocity = getattr(subject, "_velocity", self.default_velocity)
+        note_id, velocity = self.note_map.lookup(subject._event, velocity)
+        if note_id < 0:
+            if self.stats is not None:
+                self.stats.count('unmapped')
+            return
 
-        # Replace any pending event for this note_id
-        self.pending_notes[note_id] = (note_id, duration, velocity)
+        now = self.clock()
+        with self._wakeup:
+            self.backpressure.record_arrivals(1, now)
+            if not self.backpressure.admit(note_id, velocity, now):
+                if self.stats is not None:
+                    self.stats.count('dropped')
+                return
+            # Replace any pending event for this note_id
+            queued = self.pending_notes.put(note_id, duration, velocity, now)
 
-        # Drop if too many different notes pending in the queue
-        if len(self.pending_notes) > self.max_queue:
-            oldest_note = next(iter(self.pending_notes))
-            del self.pending_notes[oldest_note]
+            # Drop if too many different notes pending in the queue
+            dropped = self.backpressure.enforce(self.pending_notes)
+            self._wakeup.notify()
 
-        # Push note_id marker to queue
-        self.event_queue.put(note_id)
+        stats = self.stats
+        if stats is not None:
+            stats.observe('enqueue', self.clock() - now)
+            stats.count('enqueued')
+            if not queued:
+                stats.count('coalesced')
+            if dropped:
+                stats.count('dropped', dropped)
 
         if self.debug:
             print(f"Queued/replaced note {note_id}, vel={velocity}, dur={duration:.2f}s")
 
+    def update_batch(self, subject: "Subject", times, ids, velocities=None, durations=None):
+        """Observer callback for a chunk of events: map it in one step, coalesce per note under one lock."""
+        _, notes, velocities, mapped = self.note_map.map_batch(ids, velocities, self.default_velocity)
+        durations = (np.full(len(notes), self.default_duration) if durations is None
+                     else np.asarray(durations, dtype=np.float64))
+        unmapped = len(notes) - int(np.count_nonzero(mapped))
+        if unmapped:
+            notes, velocities, durations = notes[mapped], velocities[mapped], durations[mapped]
+        n = len(notes)
+        control = self.backpressure
+        if control.policy.filters:
+            # The policy judges every event on arrival
+            events = zip(notes.tolist(), durations.tolist(), velocities.tolist())
+        else:
+            # Only the last event per note would survive coalescing: put those, in first-arrival order
+            _, first = np.unique(notes, return_index=True)
+            _, last = np.unique(notes[::-1], return_index=True)
+            last = n - 1 - last
+            order = np.argsort(first)
+            events = zip(notes[first[order]].tolist(), durations[last[order]].tolist(),
+                         velocities[last[order]].tolist())
+
+        now = self.clock()
+        refused, queued, dropped = self.enqueue_mapped(events, n, now)
+
+        stats = self.stats
+        if stats is not None:
+            stats.observe('enqueue', self.clock() - now)
+            stats.count('enqueued', n - refused)
+            stats.count('coalesced', n - refused - queued)
+            if dropped:
+                stats.count('dropped', dropped)
+            if unmapped:
+                stats.count('unmapped', unmapped)
+
+        if self.debug:
+            print(f"Queued/replaced {n} events")
+
+    def enqueue_mapped(self, events, n, now):
+        '''
+        Admit already mapped (note, duration, velocity) events, n arrivals, into the pending table.
+        Returns (refused, queued, dropped). Also the entry point of the offline renderer, per tick.
+        '''
+        control = self.backpressure
+        with self._wakeup:
+            pending = self.pending_notes
+            control.record_arrivals(n, now)
+            refused = queued = 0
+            for note_id, duration, velocity in events:
+                if not control.admit(note_id, velocity, now):
+                    refused += 1
+                    continue
+                queued += pending.put(note_id, duration, velocity, now)
+
+            # Drop if too many different notes pending in the queue
+            dropped = control.enforce(pending) + refused
+            self._wakeup.notify()
+        return refused, queued, dropped
+
     def _player_loop(self):
-        while self.running:
-            now = time.time()
-            # Process new events
-            try:
-                while True:
-                    note_id = self.event_queue.get_nowait()
-                    # It may have deleted in the process
-                    if note_id not in self.pending_notes:
+        while True:
+            with self._wakeup:
+                # Block until a note is pending, the next note off is due or we are stopped
+                while self.running and not self.pending_notes:
+                    if not self.note_off_heap:
+                        self._wakeup.wait()
                         continue
+                    timeout = self.note_off_heap[0][0] - self.clock()
+                    if timeout <= 0:
+                        break
+                    self._wakeup.wait(timeout)
+                if not self.running:
+                    return
+                pending = self.pending_notes.drain()
+            self._flush(pending, self.clock())
+
+    def _note_on(self, note_id, velocity):
+        velocity = min(127, max(0, int(velocity)))
+        key = (note_id << 7) | velocity
+        message = self._note_on_msgs[key]
+        if message is None:
+            message = self._note_on_msgs[key] = (0x90 | self.channel, note_id, velocity)
+        return message
+
+    def _pop_due(self, now):
+        ''' Pop the note offs due by now, as (deadline, note_id) in deadline order '''
+        heap = self.note_off_heap
+        due = []
+        while heap and heap[0][0] <= now:
+            deadline, note_id = heapq.heappop(heap)
+            if self.off_deadline[note_id] > deadline:
+                # Stale entry, the note was extended meanwhile
+                heapq.heappush(heap, (self.off_deadline[note_id], note_id))
+                continue
+            self._in_heap[note_id] = 0
+            self.off_deadline[note_id] = 0.0
+            due.append((deadline, note_id))
+        return due
+
+    def _flush(self, pending, now):
+        """One scheduler tick: note ons of the drained events plus due note offs, sent as one batch."""
+        flush_start = time.perf_counter_ns()
+        batch = self._batch
+        batch.clear()
+        stats = self.stats
+        on_enqueued = []
+        off_deadlines = []
+        for note_id, duration, velocity, enqueued in pending:
+            if stats is not None:
+                stats.observe('dequeue', now - enqueued)
+            sounding = self.off_deadline[note_id] > 0.0
+            if sounding:
+                self.retriggers += 1
+            if not sounding or self.retrigger:
+                if sounding:
+                    # One note off per note on: close the sounding voice, the heap keeps the off of the new one
+                    batch.append(self._note_off_msgs[note_id])
+                batch.append(self._note_on(note_id, velocity))
+                on_enqueued.append(enqueued)
+            deadline = now + float(duration)
+            # Extend in place: the note off only ever moves later
+            if deadline > self.off_deadline[note_id]:
+                self.off_deadline[note_id] = deadline
+            if not self._in_heap[note_id]:
+                self._in_heap[note_id] = 1
+                heapq.heappush(self.note_off_heap, (deadline, note_id))
+            if self.debug:
+                print(f"Note on {note_id}, vel={velocity}, off at {self.off_deadline[note_id]:.3f}")
 
-                    note_id, duration, velocity = self.pending_notes.pop(note_id)
-                    self.midiout.send_message([0x90, note_id, velocity])
-                    heapq.heappush(self.note_off_heap, (now + duration, note_id))
-                    if self.debug:
-                        print(f"Note on {note_id}, vel={velocity}, off at {now + duration:.3f}")
-            except queue.Empty:
-                pass
+        # Process note_off events that are due
+        for deadline, note_id in self._pop_due(now):
+            batch.append(self._note_off_msgs[note_id])
+            off_deadlines.append(deadline)
+            if self.debug:
+                print(f"Note off {note_id} at {now:.3f}")
 
-            # Process note_off events that are due
-            while self.note_off_heap and self.note_off_heap[0][0] <= now:
-                _, note_id = heapq.heappop(self.note_off_heap)
-                self.midiout.send_message([0x80, note_id, 0])
-                if self.debug:
-                    print(f"Note off {note_id} at {now:.3f}")
+        if not batch:
+            return
+        tracer = self.tracer
+        traced = tracer is not None and tracer.sampled()
+        if traced:
+            start = tracer.now()
+        t0 = time.perf_counter()
+        self.sink.send_batch(batch)
+        elapsed = time.perf_counter() - t0
+        if traced:
+            tracer.record('midi_send', start, messages=len(batch))
+            # Lateness of this tick: oldest pending note or note off vs the moment it was flushed
+            late = max([now - e for e in on_enqueued] + [now - d for d in off_deadlines])
+            tracer.record('flush', flush_start, note_on=len(on_enqueued), note_off=len(off_deadlines),
+                          late_us=round(late * 1e6, 1))
+        sent_at = now + elapsed
+        for enqueued in on_enqueued:
+            self._record_timing('note_on', sent_at - enqueued)
+        for deadline in off_deadlines:
+            self._record_timing('note_off', sent_at - deadline)
+        if stats is not None:
+            stats.observe('send', elapsed)
+            stats.count('sent', len(batch))
+        with self._wakeup:
+            self.backpressure.record_drain(len(batch), elapsed)
 
-            time.sleep(0.001)  # avoid 100% CPU spin
 
+class OrchestraShards(Observer):
+    """
+    Spreads populations over MIDI channels and ports. A population is the group of neurons sharing a
+    target note in the chosen map; each population is assigned a (port, channel) shard, interleaving ports
+    first. When the config declares per-id channels (`channel:`) and no assignment is given, ids are routed
+    by them instead: one shard per declared channel, channels interleaved over the ports.
+    Every shard is an OrchestraGenerator with its own coalescing table and worker thread, so MIDI
+    throughput grows with the number of outputs instead of one thread and one port.
+    """
+    def __init__(self, params, sinks=None, population=True, channels_per_port=16, assignment=None, **generator_kwargs):
+        self.sinks = (list(sinks) if sinks else [RtMidiSink(0)])
+        note_map = params.note_maps['population' if population else 'id']
+        populations, population_of = note_map.populations()
+
+        n_ports = len(self.sinks)
+        if assignment is None and note_map.has_channels:
+            # Config channel per neuron id, assignment is channel -> (port, channel)
+            mapped = note_map.note >= 0
+            channels = np.unique(note_map.channel[mapped]).tolist()
+            assignment = {channel: (k % n_ports, channel) for k, channel in enumerate(channels)}
+            slots = sorted(set(assignment.values()))
+            slot_index = {slot: k for k, slot in enumerate(slots)}
+            shard_of_channel = np.full(16, -1, dtype=np.int16)
+            for channel, slot in assignment.items():
+                shard_of_channel[channel] = slot_index[slot]
+            self.shard_of = np.where(mapped, shard_of_channel[note_map.channel], -1).astype(np.int16)
+        else:
+            # population (target note) -> (port, channel)
+            if assignment is None:
+                assignment = {note: (k % n_ports, (k // n_ports) % channels_per_port)
+                              for k, note in enumerate(populations)}
+            slots = sorted(set(assignment.values()))
+            slot_index = {slot: k for k, slot in enumerate(slots)}
+
+            # neuron id -> shard index, -1 for unmapped ids
+            shard_of_population = np.array([slot_index[assignment[note]] for note in populations] + [-1],
+                                           dtype=np.int16)
+            self.shard_of = shard_of_population[population_of]
+
+        shared = [SharedSink(sink) for sink in self.sinks]
+        self.shards = [OrchestraGenerator(params, population=population, channel=channel, sink=shared[port],
+                                          **generator_kwargs)
+                       for port, channel in slots]
+        self.slots = slots
+        self.assignment = assignment
+
+    def update(self, subject: "Subject"):
+        id = subject._event
+        if 0 <= id < len(self.shard_of) and self.shard_of[id] >= 0:
+            self.shards[self.shard_of[id]].update(subject)
+
+    def update_batch(self, subject: "Subject", times, ids, velocities=None, durations=None):
+        """Split the chunk per shard in one stable sort and hand each shard its slice."""
+        ids = np.asarray(ids, dtype=np.int64)
+        if not len(self.shard_of):
+            return
+        inside = (ids >= 0) & (ids < len(self.shard_of))
+        shard = np.where(inside, self.shard_of[np.where(inside, ids, 0)], -1)
+        order = np.argsort(shard, kind='stable')
+        bounds = np.searchsorted(shard[order], np.arange(-1, len(self.shards) + 1))
+        columns = [np.asarray(c)[order] if c is not None else None for c in (times, ids, velocities, durations)]
+        for k, generator in enumerate(self.shards):
+            a, b = bounds[k + 1], bounds[k + 2]
+            if a == b:
+                continue
+            t, i, v, d = (c[a:b] if c is not None else None for c in columns)
+            generator.update_batch(subject, t, i, v, d)
+
+    def silence(self):
+        for generator in self.shards:
+            generator.silence()
+
+    def drop_stats(self):
+        return {slot: generator.drop_stats() for slot, generator in zip(self.slots, self.shards)}
+
+    def timing_stats(self):
+        return {slot: generator.timing_stats() for slot, generator in zip(self.slots, self.shards)}
+
+    def cleanup(self):
+        for generator in self.shards:
+            generator.cleanup()
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,56 @@
+"""
+Project: Concerto
+Description: Stand-in for the samna DYNAP-SE event sink, to run NeuroListener_Dynapse without the board.
+            get_events() returns the Poisson spikes of the given (chip, core, neuron) addresses generated since
+            the previous call, as objects with the timestamp (us), chip_id, core_id and neuron_id of samna's
+            Dynapse1Spike.
+
+                sink = DynapseStandInSink([(0, 1, 10), (2, 3, 77)], rate=50.0)
+                listener = NeuroListener_Dynapse(sink, monitored_neurons=[(0, 1, 10), (2, 3, 77)])
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import time
+from collections import namedtuple
+import numpy as np
+
+Dynapse1Spike = namedtuple('Dynapse1Spike', ['timestamp', 'chip_id', 'core_id', 'neuron_id'])
+
+
+class DynapseStandInSink():
+    """
+    rate (Hz) per neuron, one value or one per neuron. Like the board buffer, at most max_buffer events are
+    kept between two reads; the rest are counted in self.dropped.
+    """
+    def __init__(self, neurons, rate=20.0, max_buffer=100000, seed=None, clock=time.monotonic):
+        self.neurons = np.asarray(neurons, dtype=np.int64).reshape(-1, 3)
+        self.rates = np.broadcast_to(np.asarray(rate, dtype=np.float64), (len(self.neurons),))
+        self.max_buffer = max_buffer
+        self.rng = np.random.default_rng(seed)
+        self.clock = clock
+        self.start = clock()
+        self.last = self.start
+        self.dropped = 0
+        self.delivered = 0
+
+    def get_events(self):
+        now = self.clock()
+        span = now - self.last
+        counts = self.rng.poisson(self.rates * span)
+        n = int(counts.sum())
+        if n > self.max_buffer:
+            self.dropped += n - self.max_buffer
+            n = self.max_buffer
+        who = np.repeat(np.arange(len(self.neurons)), counts)[:n]
+        times = (self.last - self.start) + self.rng.random(n) * span
+        order = np.argsort(times)
+        times = np.rint(times[order] * 1e6).astype(np.int64)
+        addresses = self.neurons[who[order]]
+        self.last = now
+        self.delivered += n
+        return [Dynapse1Spike(int(t), int(chip), int(core), int(neuron))
+                for t, (chip, core, neuron) in zip(times, addresses)]
@@ -0,0 +1,115 @@
+"""
+Project: Concerto
+Description: Low-overhead counters and latency histograms for the spike-to-MIDI path. Components hold a
+            `stats` attribute that is None by default, so a disabled pipeline only pays one attribute check
+            per chunk or message. Stages: read (hardware poll), notify, enqueue, dequeue (time spent
+            pending) and send (sink.send_batch).
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import threading
+import time
+
+STAGES = ('read', 'notify', 'enqueue', 'dequeue', 'send')
+
+
+class LatencyHistogram():
+    """
+    Power-of-two microsecond buckets: bucket k holds samples below 2**k us. Recording is a bit_length()
+    and two additions, percentiles are resolved to the bucket upper bound.
+    """
+    N_BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.N_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        k = int(seconds * 1e6).bit_length()
+        self.buckets[k if k < self.N_BUCKETS else self.N_BUCKETS - 1] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, q):
+        ''' Upper bound (seconds) of the bucket holding the q-th percentile, q in [0, 100] '''
+        if not self.count:
+            return 0.0
+        rank = q / 100.0 * self.count
+        seen = 0
+        for k, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                return min((1 << k) * 1e-6, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {'count': self.count, 'mean': (self.total / self.count if self.count else 0.0),
+                'p50': self.percentile(50), 'p99': self.percentile(99), 'max': self.max}
+
+
+class PipelineStats():
+    """
+    Counters and per-stage latency histograms shared by the listener and generators. Several threads may
+    record the same counter or stage (the shard workers of OrchestraShards all count 'sent'), so updates
+    and snapshot() go through one lock.
+    """
+    def __init__(self):
+        self.started = time.monotonic()
+        self.counters = {}
+        self.stages = {stage: LatencyHistogram() for stage in STAGES}
+        self._lock = threading.Lock()
+        self._reporter = None
+        self._reporting = threading.Event()
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            hist = self.stages.get(stage)
+            if hist is None:
+                hist = self.stages[stage] = LatencyHistogram()
+            hist.record(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            return {'uptime': time.monotonic() - self.started,
+                    'counters': dict(self.counters),
+                    'stages': {stage: hist.snapshot() for stage, hist in self.stages.items()}}
+
+    def summary(self):
+        ''' One line: counters, then p50/p99 per stage in microseconds '''
+        snap = self.snapshot()
+        parts = [f"{name}={value}" for name, value in sorted(snap['counters'].items())]
+        for stage, h in snap['stages'].items():
+            if h['count']:
+                parts.append(f"{stage}[n={h['count']} p50={h['p50'] * 1e6:.0f}us p99={h['p99'] * 1e6:.0f}us]")
+        return f"[concerto {snap['uptime']:.1f}s] " + ' '.join(parts)
+
+    def start_reporter(self, interval=5.0, out=print):
+        ''' Print summary() every interval seconds from a daemon thread '''
+        if self._reporter is not None:
+            return
+        self._reporting.clear()
+
+        def report():
+            while not self._reporting.wait(interval):
+                out(self.summary())
+        self._reporter = threading.Thread(target=report, daemon=True)
+        self._reporter.start()
+
+    def stop_reporter(self):
+        if self._reporter is None:
+            return
+        self._reporting.set()
+        self._reporter.join()
+        self._reporter = None
@@ -0,0 +1,135 @@
+"""
+Project: Concerto
+Description: Offline, faster-than-real-time rendering of spike recordings to Standard MIDI Files. The recording
+            is driven through an OrchestraGenerator (same Config id/population mapping, per-note dedup and note
+            durations) on a virtual clock that follows the recording timestamps instead of the wall clock.
+
+            python -m helpers.midi_render data/net_states_sparse.pkl out.mid --population
+            python -m helpers.midi_render data/net_states_sparse.spk out.mid
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import argparse
+import bisect
+import pickle
+import struct
+import numpy as np
+
+from helpers.concerto_classes import Config, NeuroListener, OrchestraGenerator
+from helpers.midi_sinks import RecordingSink, encode_stream
+
+
+class VirtualClock():
+    ''' Settable clock handed to the generator and the recording sink '''
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _vlq(value):
+    out = [value & 0x7F]
+    value >>= 7
+    while value:
+        out.append(0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(reversed(out))
+
+
+def write_smf(path, messages, ppq=960, tempo=500000):
+    '''
+    Write (seconds, message) pairs, time ordered, as a format 0 Standard MIDI File with running status.
+    tempo in us per quarter note, ppq ticks per quarter note.
+    '''
+    ticks_per_second = ppq * 1e6 / tempo
+    track = bytearray(b'\x00\xFF\x51\x03' + tempo.to_bytes(3, 'big'))
+    status = None
+    last_tick = 0
+    for seconds, message in messages:
+        tick = max(last_tick, int(round(seconds * ticks_per_second)))
+        data, status = encode_stream((message,), True, status)
+        track += _vlq(tick - last_tick)
+        track += data
+        last_tick = tick
+    track += b'\x00\xFF\x2F\x00'
+    with open(path, 'wb') as f:
+        f.write(b'MThd' + struct.pack('>IHHH', 6, 0, 1, ppq))
+        f.write(b'MTrk' + struct.pack('>I', len(track)))
+        f.write(track)
+
+
+def render(listener, config, population=False, tick=0.001, chunk_size=65536, **generator_kwargs):
+    '''
+    Drive listener's recording through an OrchestraGenerator on a virtual clock and return the emitted
+    (seconds, message) pairs. Events within one tick form one batch like in the live replay; due note
+    offs are flushed at their own deadlines. The admission limit is pinned to max_queue: the wall clock
+    cost of the sends must not change what a render contains.
+    '''
+    clock = VirtualClock()
+    sink = RecordingSink(clock=clock)
+    generator_kwargs['target_latency'] = None
+    generator = OrchestraGenerator(config, population=population, sink=sink, clock=clock, start_worker=False,
+                                   **generator_kwargs)
+    heap = generator.note_off_heap
+    note_offs = generator._note_off_msgs
+    recorded = sink.messages
+
+    def advance(until):
+        # Note offs due before `until`, each recorded at its own deadline
+        if heap and heap[0][0] <= until:
+            for deadline, note_id in generator._pop_due(until):
+                clock.now = max(clock.now, deadline)
+                recorded.append((clock.now, note_offs[note_id]))
+        clock.now = max(clock.now, until)
+
+    # Each chunk is mapped once, ticks only run the per-note admission (pending events coalesce per note)
+    for ts, ids, velocities, durations, offsets in listener.iter_batches(chunk_size):
+        _, notes, velocities, mapped = generator.note_map.map_batch(ids, velocities, generator.default_velocity)
+        ends = np.cumsum(mapped).tolist()   # mapped events in [0, k) = ends[k - 1]
+        keep = np.flatnonzero(mapped)
+        events = list(zip(notes[keep].tolist(), durations[keep].tolist(), velocities[keep].tolist()))
+        offsets = offsets.tolist()
+        i, n, m = 0, len(offsets), 0
+        while i < n:
+            j = bisect.bisect_left(offsets, offsets[i] + tick, i)
+            # Released once the last event of the tick has arrived, never early
+            advance(offsets[j - 1])
+            k = ends[j - 1]
+            if k > m:
+                generator.enqueue_mapped(events[m:k], k - m, clock.now)
+                generator._flush(generator.pending_notes.drain(), clock.now)
+            m = k
+            i = j
+    advance(float('inf'))
+    generator.cleanup()
+    return sink.messages
+
+
+def render_file(in_path, out_path, config, population=False, ppq=960, tempo=500000, **kwargs):
+    ''' Render a .spk columnar recording or a data/*.pkl pickle (timestamps in seconds) to a .mid file '''
+    if in_path.endswith('.pkl'):
+        with open(in_path, 'rb') as f:
+            ts_lists, id_lists = pickle.load(f)[:2]
+        listener = NeuroListener.from_populations(ts_lists, id_lists, time_unit=1.0)
+    else:
+        listener = NeuroListener.from_recording(in_path)
+    messages = render(listener, config, population=population, **kwargs)
+    write_smf(out_path, messages, ppq=ppq, tempo=tempo)
+    return len(messages)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Render a spike recording to a Standard MIDI File")
+    parser.add_argument('recording')
+    parser.add_argument('output')
+    parser.add_argument('--config', default='helpers/config_orchestra.yaml')
+    parser.add_argument('--population', action='store_true', help="use the population map instead of id")
+    args = parser.parse_args()
+    n = render_file(args.recording, args.output, Config(args.config, 'brain_to_wave'),
+                    population=args.population)
+    print(f"Wrote {n} MIDI messages to {args.output}")
@@ -0,0 +1,128 @@
+"""
+Project: Concerto
+Description: MIDI output sinks for OrchestraGenerator. The generator hands each sink one batch of pre-encoded
+            messages (tuples of ints, reused between ticks) per scheduler tick. Sinks: rtmidi port, null,
+            in-memory recording and fan-out to several sinks/ports.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import threading
+import time
+from abc import ABC, abstractmethod
+
+
+def encode_stream(messages, running_status=True, status=None):
+    '''
+    Concatenate messages into a MIDI byte stream. With running_status the status byte is omitted when it
+    repeats the previous channel voice status. Returns (bytes, last status) so streams can be continued.
+    '''
+    out = bytearray()
+    for message in messages:
+        if running_status and message[0] == status and message[0] < 0xF0:
+            out.extend(message[1:])
+        else:
+            out.extend(message)
+            status = message[0] if message[0] < 0xF0 else None
+    return bytes(out), status
+
+
+class MidiSink(ABC):
+    """
+    A sink receives a batch of complete MIDI messages per tick.
+    """
+    @abstractmethod
+    def send_batch(self, messages) -> None:
+        pass
+
+    def send_message(self, message) -> None:
+        self.send_batch((message,))
+
+    def close(self) -> None:
+        pass
+
+
+class RtMidiSink(MidiSink):
+    ''' rtmidi output port (virtual port if no hardware port is available) '''
+    def __init__(self, port_id=0, virtual_name="My virtual output"):
+        import rtmidi
+        self.midiout = rtmidi.MidiOut()
+        available_ports = self.midiout.get_ports()
+        if available_ports:
+            self.midiout.open_port(port_id)
+        else:
+            self.midiout.open_virtual_port(virtual_name)
+
+    def send_batch(self, messages):
+        # rtmidi takes whole messages only, running status does not apply here
+        send = self.midiout.send_message
+        for message in messages:
+            send(message)
+
+    def close(self):
+        if self.midiout.is_port_open():
+            self.midiout.close_port()
+        del self.midiout
+
+
+class NullSink(MidiSink):
+    ''' Discards everything, counts messages and batches '''
+    def __init__(self):
+        self.count = 0
+        self.batches = 0
+
+    def send_batch(self, messages):
+        self.count += len(messages)
+        self.batches += 1
+
+
+class RecordingSink(MidiSink):
+    '''
+    Keeps (time, message) pairs in memory, time from `clock` (perf_counter by default).
+    stream() gives the recording as one running-status byte stream.
+    '''
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.messages = []
+
+    def send_batch(self, messages):
+        now = self.clock()
+        self.messages.extend((now, message) for message in messages)
+
+    @property
+    def count(self):
+        return len(self.messages)
+
+    def stream(self, running_status=True):
+        return encode_stream((m for _, m in self.messages), running_status)[0]
+
+
+class FanOutSink(MidiSink):
+    ''' Same batch to several sinks, e.g. one RtMidiSink per port '''
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+
+    def send_batch(self, messages):
+        for sink in self.sinks:
+            sink.send_batch(messages)
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class SharedSink(MidiSink):
+    '''
+    Serializes the batches of several generators writing to one sink (e.g. shards on the same port).
+    close() is left to the owner of the underlying sink.
+    '''
+    def __init__(self, sink):
+        self.sink = sink
+        self._lock = threading.Lock()
+
+    def send_batch(self, messages):
+        with self._lock:
+            self.sink.send_batch(messages)
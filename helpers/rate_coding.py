@@ -0,0 +1,158 @@
+"""
+Project: Concerto
+Description: Population rate coding. Instead of one note per spike, spikes are binned per population over a sliding
+            window with incremental counters and the population firing rate is sent at a fixed control rate as
+            velocity, MIDI CC, pitch bend or polyphonic aftertouch. MIDI traffic becomes O(populations x control
+            rate) whatever the spike rate.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import threading
+import time
+import numpy as np
+
+from helpers.concerto_classes import Observer, Subject
+from helpers.midi_sinks import RtMidiSink
+
+MODES = ('velocity', 'cc', 'pitchbend', 'aftertouch')
+
+
+class PopulationRateObserver(Observer):
+    """
+    Sliding window of n_bins bins per population: a spike increments the current bin and the running
+    window total, advancing a bin subtracts the bin that falls out of the window. Every 1/control_rate
+    seconds the window rate (Hz) of each population is scaled by max_rate to 0..127 (pitch bend: centre
+    8192 at rest up to 16383 at full scale) and sent when it changed:
+        velocity   note on of the population note with that velocity (note off when it drops to 0)
+        cc         controller cc_base + population index on `channel`
+        pitchbend  one channel per population (population index mod 16)
+        aftertouch polyphonic aftertouch on the population note
+    """
+    def __init__(self, params, mode='cc', population=True, window=0.25, n_bins=25, control_rate=50.0,
+                 max_rate=None, channel=0, cc_base=20, sink=None, clock=time.monotonic, start_worker=True):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.mode = mode
+        self.channel = channel
+        self.cc_base = cc_base
+        self.clock = clock
+        self.sink = (sink if sink is not None else RtMidiSink(0))
+        note_map = params.note_maps['population' if population else 'id']
+        self.notes, population_of = note_map.populations()
+        self.population_of = np.append(population_of, -1).astype(np.int64)   # last slot catches out-of-range ids
+        n_pop = len(self.notes)
+        self.n_populations = n_pop
+
+        self.window = window
+        self.n_bins = n_bins
+        self.bin_width = window / n_bins
+        self.counts = np.zeros((n_bins, n_pop), dtype=np.int64)
+        self.total = np.zeros(n_pop, dtype=np.int64)
+        self._bin = 0
+        self._bin_start = clock()
+        # Full scale defaults to every neuron of the population firing at 100 Hz
+        sizes = np.bincount(population_of[population_of >= 0], minlength=n_pop)
+        self.max_rate = (np.maximum(sizes, 1) * 100.0 if max_rate is None
+                         else np.full(n_pop, float(max_rate)))
+        self._last_value = np.full(n_pop, -1, dtype=np.int64)
+        self._lock = threading.Lock()
+
+        self.control_period = 1.0 / control_rate
+        self.running = True
+        self._stop = threading.Event()
+        self.worker = None
+        if start_worker:
+            self.worker = threading.Thread(target=self._control_loop, daemon=True)
+            self.worker.start()
+
+    def _advance(self, now):
+        # Caller holds the lock. Retire the bins that fell out of the window since the last call
+        steps = int((now - self._bin_start) / self.bin_width)
+        if steps <= 0:
+            return
+        for _ in range(min(steps, self.n_bins)):
+            self._bin = (self._bin + 1) % self.n_bins
+            self.total -= self.counts[self._bin]
+            self.counts[self._bin] = 0
+        self._bin_start += steps * self.bin_width
+
+    def _populations(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        ids = np.where((ids >= 0) & (ids < len(self.population_of) - 1), ids, -1)
+        pops = self.population_of[ids]
+        return pops[pops >= 0]
+
+    def update(self, subject: Subject):
+        self.update_batch(subject, None, (subject._event,))
+
+    def update_batch(self, subject: Subject, times, ids, velocities=None, durations=None):
+        counts = np.bincount(self._populations(ids), minlength=self.n_populations)
+        now = self.clock()
+        with self._lock:
+            self._advance(now)
+            self.counts[self._bin] += counts
+            self.total += counts
+
+    def rates(self):
+        ''' Current window firing rate per population (Hz), in the order of self.notes '''
+        with self._lock:
+            self._advance(self.clock())
+            return self.total / self.window
+
+    def _encode(self, k, value, previous):
+        note = self.notes[k]
+        if self.mode == 'cc':
+            return [(0xB0 | self.channel, (self.cc_base + k) & 0x7F, value)]
+        if self.mode == 'pitchbend':
+            return [(0xE0 | (k % 16), value & 0x7F, value >> 7)]
+        if self.mode == 'aftertouch':
+            return [(0xA0 | self.channel, note, value)]
+        if value == 0:
+            return [(0x80 | self.channel, note, 0)]
+        messages = [(0x80 | self.channel, note, 0)] if previous > 0 else []
+        messages.append((0x90 | self.channel, note, value))
+        return messages
+
+    def control_tick(self):
+        ''' Send the populations whose coded rate changed since the last tick, returns the messages '''
+        full_scale = (8191 if self.mode == 'pitchbend' else 127)
+        rates = self.rates()
+        values = np.minimum(np.rint(rates / self.max_rate * full_scale), full_scale).astype(np.int64)
+        if self.mode == 'pitchbend':
+            values += 8192
+        changed = np.flatnonzero(values != self._last_value)
+        batch = []
+        for k in changed.tolist():
+            batch.extend(self._encode(k, int(values[k]), int(self._last_value[k])))
+        self._last_value = values
+        if batch:
+            self.sink.send_batch(batch)
+        return batch
+
+    def _control_loop(self):
+        deadline = self.clock()
+        while self.running:
+            deadline += self.control_period
+            self.control_tick()
+            wait = deadline - self.clock()
+            if wait < 0:
+                # Late: skip the missed ticks instead of bursting them
+                deadline = self.clock()
+                wait = 0
+            if self._stop.wait(wait):
+                return
+
+    def silence(self):
+        if self.mode == 'velocity':
+            self.sink.send_message((0xB0 | self.channel, 123, 0))
+
+    def cleanup(self):
+        self.running = False
+        self._stop.set()
+        if self.worker is not None:
+            self.worker.join()
+        self.sink.close()
@@ -0,0 +1,216 @@
+"""
+Project: Concerto
+Description: Columnar binary spike recording format. Events are stored time-sorted as two flat columns
+            (int64 timestamps, int32 neuron ids) after a small header with the population metadata, so a
+            recording can be memory-mapped and streamed in chunks instead of unpickled as nested lists.
+
+            Layout (little endian):
+                magic       8s   b'CNCSPK01'
+                version     u32
+                meta_len    u32  length of the JSON metadata block
+                n_events    u64
+                data_offset u64  start of the timestamp column (64-byte aligned)
+                time_unit   f64  seconds per timestamp unit
+                metadata    JSON (utf-8), zero padded up to data_offset
+                timestamps  int64[n_events]
+                ids         int32[n_events]
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import heapq
+import itertools
+import json
+import os
+import pickle
+import struct
+import sys
+import numpy as np
+
+MAGIC = b'CNCSPK01'
+VERSION = 1
+_HEADER = struct.Struct('<8sIIQQd')
+_ALIGN = 64
+TS_DTYPE = np.dtype('<i8')
+ID_DTYPE = np.dtype('<i4')
+
+
+def _aligned(n):
+    return (n + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+def write_spikes(path, times, ids, time_unit=1e-6, metadata=None):
+    ''' Write time-sorted integer timestamps and neuron ids to a columnar recording '''
+    times = np.ascontiguousarray(times, dtype=TS_DTYPE)
+    ids = np.ascontiguousarray(ids, dtype=ID_DTYPE)
+    if times.shape != ids.shape or times.ndim != 1:
+        raise ValueError("times and ids must be 1-D columns of the same length")
+    if len(times) > 1 and np.any(times[1:] < times[:-1]):
+        raise ValueError("timestamps must be sorted")
+    meta = json.dumps(metadata or {}).encode('utf-8')
+    data_offset = _aligned(_HEADER.size + len(meta))
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, len(meta), len(times), data_offset, time_unit))
+        f.write(meta)
+        f.write(b'\0' * (data_offset - _HEADER.size - len(meta)))
+        f.write(times.tobytes())
+        f.write(ids.tobytes())
+
+
+class SpikeRecording():
+    '''
+    Memory-mapped reader of a columnar recording. Only the header is parsed on open; the columns are
+    paged in by the OS as chunks are accessed.
+    '''
+    def __init__(self, path):
+        self.path = path
+        size = os.path.getsize(path)
+        with open(path, 'rb') as f:
+            head = f.read(_HEADER.size)
+            if len(head) < _HEADER.size:
+                raise ValueError(f"{path}: truncated header")
+            magic, version, meta_len, n_events, data_offset, time_unit = _HEADER.unpack(head)
+            if magic != MAGIC:
+                raise ValueError(f"{path}: not a Concerto spike recording")
+            if version != VERSION:
+                raise ValueError(f"{path}: unsupported version {version}")
+            if data_offset + n_events * (TS_DTYPE.itemsize + ID_DTYPE.itemsize) > size:
+                raise ValueError(f"{path}: file shorter than its header announces")
+            self.metadata = json.loads(f.read(meta_len).decode('utf-8') or '{}')
+        self.n_events = n_events
+        self.time_unit = time_unit
+        if n_events:
+            self.times = np.memmap(path, dtype=TS_DTYPE, mode='r', offset=data_offset, shape=(n_events,))
+            self.ids = np.memmap(path, dtype=ID_DTYPE, mode='r',
+                                 offset=data_offset + n_events * TS_DTYPE.itemsize, shape=(n_events,))
+        else:
+            self.times = np.empty(0, dtype=TS_DTYPE)
+            self.ids = np.empty(0, dtype=ID_DTYPE)
+
+    def __len__(self):
+        return self.n_events
+
+    @property
+    def duration(self):
+        ''' Recording length in seconds '''
+        if not self.n_events:
+            return 0.0
+        return float(self.times[-1] - self.times[0]) * self.time_unit
+
+    def iter_chunks(self, chunk_size=65536):
+        ''' Yield (timestamps, ids) views of at most chunk_size events '''
+        for k in range(0, self.n_events, chunk_size):
+            yield self.times[k:k + chunk_size], self.ids[k:k + chunk_size]
+
+
+def _merge_heap(ts_lists, id_lists, chunk_size):
+    # Lazy heap merge of per-population iterators, ties keep population order. The population index
+    # is zipped in, a generator expression would only read the loop variable once the merge runs.
+    streams = [zip(t_list, itertools.repeat(k), i_list)
+               for k, (t_list, i_list) in enumerate(zip(ts_lists, id_lists))]
+    ts, ids, pops = [], [], []
+    for t, k, i in heapq.merge(*streams, key=lambda e: e[0]):
+        ts.append(t)
+        ids.append(i)
+        pops.append(k)
+        if len(ts) == chunk_size:
+            yield np.asarray(ts, dtype=np.float64), np.asarray(ids), np.asarray(pops, dtype=np.int32)
+            ts, ids, pops = [], [], []
+    if ts:
+        yield np.asarray(ts, dtype=np.float64), np.asarray(ids), np.asarray(pops, dtype=np.int32)
+
+
+def _merge_arrays(ts_arrays, id_arrays, chunk_size):
+    # Vectorized merge: take a window from every population, emit everything before the earliest
+    # window end (no later event of any population can precede it), then advance the cursors.
+    cursors = [0] * len(ts_arrays)
+    while True:
+        live = [k for k, t in enumerate(ts_arrays) if cursors[k] < len(t)]
+        if not live:
+            return
+        horizon = None
+        for k in live:
+            end = cursors[k] + chunk_size
+            if end < len(ts_arrays[k]):
+                last = ts_arrays[k][end - 1]
+                horizon = last if horizon is None else min(horizon, last)
+        if horizon is None:
+            cuts = {k: len(ts_arrays[k]) for k in live}
+        else:
+            cuts = {k: cursors[k] + int(np.searchsorted(ts_arrays[k][cursors[k]:cursors[k] + chunk_size],
+                                                        horizon, side='left')) for k in live}
+            if all(cuts[k] == cursors[k] for k in live):
+                # Every window starts with the horizon value: release that whole timestamp at once
+                cuts = {k: cursors[k] + int(np.searchsorted(ts_arrays[k][cursors[k]:], horizon, side='right'))
+                        for k in live}
+        ts = np.concatenate([ts_arrays[k][cursors[k]:cuts[k]] for k in live])
+        ids = np.concatenate([id_arrays[k][cursors[k]:cuts[k]] for k in live])
+        pops = np.concatenate([np.full(cuts[k] - cursors[k], k, dtype=np.int32) for k in live])
+        order = np.argsort(ts, kind='stable')
+        for k in live:
+            cursors[k] = cuts[k]
+        for a in range(0, len(order), chunk_size):
+            sel = order[a:a + chunk_size]
+            yield ts[sel], ids[sel], pops[sel]
+
+
+def _time_ordered(t_list, i_list):
+    # Recorded trains are ordered up to rare glitches: only sort the populations that need it
+    if isinstance(t_list, np.ndarray):
+        if len(t_list) > 1 and np.any(t_list[1:] < t_list[:-1]):
+            order = np.argsort(t_list, kind='stable')
+            return t_list[order], np.asarray(i_list)[order]
+        return t_list, i_list
+    if any(b < a for a, b in zip(t_list, t_list[1:])):
+        pairs = sorted(zip(t_list, i_list), key=lambda e: e[0])
+        return [p[0] for p in pairs], [p[1] for p in pairs]
+    return t_list, i_list
+
+
+def iter_merged(ts_lists, id_lists, chunk_size=65536):
+    '''
+    Streaming k-way merge of per-population spike trains, each (nearly) time-ordered. Yields
+    time-ordered (timestamps, ids, population_index) array chunks lazily. NumPy inputs are merged
+    vectorized window by window, anything else through a heap over the population iterators.
+    '''
+    trains = [_time_ordered(t, i) for t, i in zip(ts_lists, id_lists)]
+    ts_lists = [t for t, _ in trains]
+    id_lists = [i for _, i in trains]
+    if all(isinstance(t, np.ndarray) for t in ts_lists) and all(isinstance(i, np.ndarray) for i in id_lists):
+        return _merge_arrays(ts_lists, id_lists, chunk_size)
+    return _merge_heap(ts_lists, id_lists, chunk_size)
+
+
+def convert_pickle(pkl_path, out_path, source_unit=1.0, time_unit=1e-6):
+    '''
+    Convert a data/*.pkl recording ([ts_lists, id_lists], one list per population, timestamps in
+    source_unit seconds) into the columnar format. Only use it on pickles you trust.
+    '''
+    with open(pkl_path, 'rb') as f:
+        ts_lists, id_lists = pickle.load(f)[:2]
+    populations = []
+    ts_cols, id_cols = [], []
+    for k, (t_list, i_list) in enumerate(zip(ts_lists, id_lists)):
+        t = np.rint(np.asarray(t_list, dtype=np.float64) * (source_unit / time_unit)).astype(TS_DTYPE)
+        i = np.asarray(i_list, dtype=ID_DTYPE)
+        ts_cols.append(t)
+        id_cols.append(i)
+        populations.append({'index': k, 'count': len(i), 'ids': sorted(int(x) for x in np.unique(i))})
+    chunks = list(iter_merged(ts_cols, id_cols))
+    times = np.concatenate([c[0] for c in chunks]) if chunks else np.empty(0, dtype=TS_DTYPE)
+    ids = np.concatenate([c[1] for c in chunks]) if chunks else np.empty(0, dtype=ID_DTYPE)
+    metadata = {'source': os.path.basename(pkl_path), 'populations': populations}
+    write_spikes(out_path, times, ids, time_unit=time_unit, metadata=metadata)
+    return out_path
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python -m helpers.spike_format <recording.pkl> <recording.spk>")
+        sys.exit(1)
+    convert_pickle(sys.argv[1], sys.argv[2])
+    rec = SpikeRecording(sys.argv[2])
+    print(f"Wrote {len(rec)} events, {rec.duration:.3f}s, to {sys.argv[2]}")
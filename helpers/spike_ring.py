@@ -0,0 +1,91 @@
+"""
+Project: Concerto
+Description: Single-producer / single-consumer ring of (timestamp, neuron id) records in preallocated arrays.
+            The producer only moves `head`, the consumer only moves `tail`, so neither side takes a lock and a
+            slow consumer never blocks the producer: records that do not fit are counted as overflow.
+            The ring can live in any writable buffer (e.g. multiprocessing shared memory).
+
+            Buffer layout: int64 header [head, tail, overflow, capacity], float64 ts[capacity], int32 ids[capacity]
+            (float64 timestamps hold integer microsecond clocks exactly and float-second clocks as is)
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import numpy as np
+
+_HEAD, _TAIL, _OVERFLOW, _CAPACITY = range(4)
+HEADER_BYTES = 4 * 8
+
+
+def ring_bytes(capacity):
+    ''' Buffer size needed for a ring of capacity records '''
+    return HEADER_BYTES + capacity * (8 + 4)
+
+
+class SpikeRing():
+    def __init__(self, capacity=1 << 16, buffer=None, create=True):
+        '''
+        capacity records in `buffer` (allocated when None). create=False attaches to a ring already
+        initialised in buffer by another process and takes its capacity from the header.
+        '''
+        if buffer is None:
+            buffer = bytearray(ring_bytes(capacity))
+        self.header = np.frombuffer(buffer, dtype=np.int64, count=4, offset=0)
+        if create:
+            self.header[:] = (0, 0, 0, capacity)
+        capacity = int(self.header[_CAPACITY])
+        self.capacity = capacity
+        self.ts = np.frombuffer(buffer, dtype=np.float64, count=capacity, offset=HEADER_BYTES)
+        self.ids = np.frombuffer(buffer, dtype=np.int32, count=capacity, offset=HEADER_BYTES + 8 * capacity)
+
+    def close(self):
+        ''' Drop the array views so the underlying buffer (shared memory) can be closed '''
+        self.header = self.ts = self.ids = None
+
+    def __len__(self):
+        return int(self.header[_HEAD] - self.header[_TAIL])
+
+    @property
+    def overflow(self):
+        return int(self.header[_OVERFLOW])
+
+    def write(self, ts, ids):
+        ''' Producer side: append what fits, count the rest as overflow. Returns the number written '''
+        n = len(ids)
+        head = int(self.header[_HEAD])
+        free = self.capacity - (head - int(self.header[_TAIL]))
+        if n > free:
+            self.header[_OVERFLOW] += n - free
+            n = free
+        if n <= 0:
+            return 0
+        start = head % self.capacity
+        first = min(n, self.capacity - start)
+        self.ts[start:start + first] = ts[:first]
+        self.ids[start:start + first] = ids[:first]
+        if first < n:
+            self.ts[:n - first] = ts[first:n]
+            self.ids[:n - first] = ids[first:n]
+        # Publish only after the records are in place
+        self.header[_HEAD] = head + n
+        return n
+
+    def read(self, max_n=None):
+        ''' Consumer side: copy out up to max_n records as (ts, ids) arrays, empty arrays when idle '''
+        tail = int(self.header[_TAIL])
+        n = int(self.header[_HEAD]) - tail
+        if max_n is not None:
+            n = min(n, max_n)
+        start = tail % self.capacity
+        first = min(n, self.capacity - start)
+        if first == n:
+            ts = self.ts[start:start + n].copy()
+            ids = self.ids[start:start + n].copy()
+        else:
+            ts = np.concatenate((self.ts[start:], self.ts[:n - first]))
+            ids = np.concatenate((self.ids[start:], self.ids[:n - first]))
+        self.header[_TAIL] = tail + n
+        return ts, ids
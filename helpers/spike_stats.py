@@ -0,0 +1,278 @@
+"""
+Project: Concerto
+Description: Live network statistics. SpikeStatsObserver attaches next to the MIDI generator and keeps, over a sliding
+            window of n_bins time bins, per-neuron and per-population spike counts, per-neuron ISI moments (for the
+            coefficient of variation) and per-population log-spaced ISI histograms. Each batch only adds to the
+            cells it touches, so its cost follows the batch size; retiring a bin subtracts it. Window time follows
+            the spike timestamps.
+            A snapshot (rates, CV, ISI histograms and the pairwise synchrony of the populations, i.e. the
+            correlation of their binned counts) is published at a fixed rate and served by the query methods
+            without touching the update path.
+
+                stats = SpikeStatsObserver(config, population=True)
+                listener.attach(stats)
+                stats.population_rates(), stats.cv(), stats.synchrony()
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import math
+import threading
+import time
+import numpy as np
+
+from helpers.concerto_classes import Observer, Subject
+
+
+class SpikeStatsObserver(Observer):
+    """
+    params (Config) gives the populations (neurons sharing a target note of the id or population map) and
+    the neuron id range; without params, n_neurons ids in one population. time_unit is the duration of one
+    timestamp unit in seconds. ISI histogram edges are log spaced from isi_min to isi_max seconds.
+    update() takes the event time from subject._time (SpikeEvent, NeuroListener streaming) and only falls
+    back to the monotonic clock for subjects that carry no timestamp.
+    """
+    def __init__(self, params=None, population=True, n_neurons=None, window=1.0, n_bins=20, time_unit=1e-6,
+                 isi_min=1e-3, isi_max=10.0, n_isi_bins=40, snapshot_rate=4.0, start_worker=True):
+        if params is not None:
+            note_map = params.note_maps['population' if population else 'id']
+            self.notes, population_of = note_map.populations()
+            population_of = np.asarray(population_of, dtype=np.int64)
+        else:
+            self.notes = [0]
+            population_of = np.zeros(n_neurons or 256, dtype=np.int64)
+        n_neurons = len(population_of)
+        self.n_neurons = n_neurons
+        self.n_populations = len(self.notes)
+        self.population_of = population_of
+        self.population_size = np.bincount(population_of[population_of >= 0], minlength=self.n_populations)
+        self._membership = np.zeros((n_neurons, self.n_populations))
+        self._membership[np.flatnonzero(population_of >= 0), population_of[population_of >= 0]] = 1.0
+
+        self.window = window
+        self.n_bins = n_bins
+        self.bin_width = window / n_bins
+        self.time_unit = time_unit
+        self.isi_edges = np.geomspace(isi_min, isi_max, n_isi_bins + 1)
+        self._log_min = np.log(isi_min)
+        self._log_step = np.log(isi_max / isi_min) / n_isi_bins
+        self.n_isi_bins = n_isi_bins
+
+        # Per bin slot: spike counts, ISI count / sum / sum of squares per neuron, ISI histogram per population
+        self.counts = np.zeros((n_bins, n_neurons), dtype=np.int64)
+        self.isi_n = np.zeros((n_bins, n_neurons), dtype=np.int64)
+        self.isi_sum = np.zeros((n_bins, n_neurons))
+        self.isi_sumsq = np.zeros((n_bins, n_neurons))
+        self.isi_hist = np.zeros((n_bins, self.n_populations, n_isi_bins), dtype=np.int64)
+        # Running window totals, kept in step with the slots
+        self.total = np.zeros(n_neurons, dtype=np.int64)
+        self.total_isi_n = np.zeros(n_neurons, dtype=np.int64)
+        self.total_isi_sum = np.zeros(n_neurons)
+        self.total_isi_sumsq = np.zeros(n_neurons)
+        self.total_isi_hist = np.zeros((self.n_populations, n_isi_bins), dtype=np.int64)
+        self.last_spike = np.full(n_neurons, np.nan)
+        self._bin = None      # absolute index of the newest bin
+        self._t_first = None
+        self.events = 0
+        self.out_of_range = 0
+        self._lock = threading.Lock()
+
+        self.snapshot_period = 1.0 / snapshot_rate
+        self.latest = self._compute_snapshot()
+        self.running = True
+        self._stop = threading.Event()
+        self.worker = None
+        if start_worker:
+            self.worker = threading.Thread(target=self._snapshot_loop, daemon=True)
+            self.worker.start()
+
+    def _retire(self, slots):
+        for slot in slots:
+            self.total -= self.counts[slot]
+            self.total_isi_n -= self.isi_n[slot]
+            self.total_isi_sum -= self.isi_sum[slot]
+            self.total_isi_sumsq -= self.isi_sumsq[slot]
+            self.total_isi_hist -= self.isi_hist[slot]
+            self.counts[slot] = 0
+            self.isi_n[slot] = 0
+            self.isi_sum[slot] = 0.0
+            self.isi_sumsq[slot] = 0.0
+            self.isi_hist[slot] = 0
+
+    def _advance(self, newest):
+        # Move the window so that bin `newest` is inside it, retiring the slots it reuses. Under the lock.
+        if self._bin is None:
+            self._bin = newest
+        elif newest > self._bin:
+            steps = min(newest - self._bin, self.n_bins)
+            self._retire([(self._bin + k) % self.n_bins for k in range(1, steps + 1)])
+            self._bin = newest
+
+    def _isi_bin(self, isi):
+        return min(max(int((math.log(max(isi, 1e-12)) - self._log_min) / self._log_step), 0), self.n_isi_bins - 1)
+
+    def update(self, subject: Subject):
+        # One event, scalar arithmetic on the touched cells only
+        stamp = getattr(subject, '_time', None)
+        t = (time.monotonic() if stamp is None else stamp * self.time_unit)
+        neuron = int(subject._event)
+        if not 0 <= neuron < self.n_neurons:
+            self.out_of_range += 1
+            return
+        absolute = math.floor(t / self.bin_width)
+        with self._lock:
+            if self._t_first is None:
+                self._t_first = t
+            self._advance(absolute)
+            previous = self.last_spike[neuron]
+            if absolute > self._bin - self.n_bins:
+                slot = absolute % self.n_bins
+                self.counts[slot, neuron] += 1
+                self.total[neuron] += 1
+                isi = t - previous
+                if isi >= 0:    # False for nan, the first spike of a neuron
+                    self.isi_n[slot, neuron] += 1
+                    self.isi_sum[slot, neuron] += isi
+                    self.isi_sumsq[slot, neuron] += isi * isi
+                    self.total_isi_n[neuron] += 1
+                    self.total_isi_sum[neuron] += isi
+                    self.total_isi_sumsq[neuron] += isi * isi
+                    pop = self.population_of[neuron]
+                    if pop >= 0:
+                        k = self._isi_bin(isi)
+                        self.isi_hist[slot, pop, k] += 1
+                        self.total_isi_hist[pop, k] += 1
+            if not t <= previous:
+                self.last_spike[neuron] = t
+            self.events += 1
+
+    def update_batch(self, subject: Subject, times, ids, velocities=None, durations=None):
+        if times is None:
+            times = np.full(len(ids), time.monotonic() / self.time_unit)
+        t = np.asarray(times, dtype=np.float64) * self.time_unit
+        ids = np.asarray(ids, dtype=np.int64)
+        inside = (ids >= 0) & (ids < self.n_neurons)
+        if not inside.all():
+            self.out_of_range += int(np.count_nonzero(~inside))
+            t, ids = t[inside], ids[inside]
+        if not len(ids):
+            return
+        n_bins = self.n_bins
+        absolute = np.floor(t / self.bin_width).astype(np.int64)
+
+        # ISIs: group the batch per neuron in time order, the first spike of each neuron pairs with its last one
+        order = np.lexsort((t, ids))
+        s_ids, s_t, s_abs = ids[order], t[order], absolute[order]
+        first = np.ones(len(s_ids), dtype=bool)
+        first[1:] = s_ids[1:] != s_ids[:-1]
+        last = np.ones(len(s_ids), dtype=bool)
+        last[:-1] = first[1:]
+
+        # Only the cells the batch touches are written (np.add.at), the cost follows the batch, not the state
+        with self._lock:
+            if self._t_first is None:
+                self._t_first = float(t.min())
+            self._advance(int(absolute.max()))
+            keep = absolute > self._bin - n_bins
+            k_ids = ids[keep]
+            np.add.at(self.counts, (absolute[keep] % n_bins, k_ids), 1)
+            np.add.at(self.total, k_ids, 1)
+
+            previous = np.where(first, self.last_spike[s_ids], np.concatenate(([np.nan], s_t[:-1])))
+            isi = s_t - previous
+            valid = np.isfinite(isi) & (isi >= 0) & (s_abs > self._bin - n_bins)
+            if valid.any():
+                isi, i_ids, i_slot = isi[valid], s_ids[valid], s_abs[valid] % n_bins
+                cells = (i_slot, i_ids)
+                np.add.at(self.isi_n, cells, 1)
+                np.add.at(self.isi_sum, cells, isi)
+                np.add.at(self.isi_sumsq, cells, isi * isi)
+                np.add.at(self.total_isi_n, i_ids, 1)
+                np.add.at(self.total_isi_sum, i_ids, isi)
+                np.add.at(self.total_isi_sumsq, i_ids, isi * isi)
+                pops = self.population_of[i_ids]
+                mapped = pops >= 0
+                k = np.clip(((np.log(np.maximum(isi[mapped], 1e-12)) - self._log_min) / self._log_step).astype(np.int64),
+                            0, self.n_isi_bins - 1)
+                np.add.at(self.isi_hist, (i_slot[mapped], pops[mapped], k), 1)
+                np.add.at(self.total_isi_hist, (pops[mapped], k), 1)
+            self.last_spike[s_ids[last]] = np.fmax(self.last_spike[s_ids[last]], s_t[last])
+            self.events += len(ids)
+
+    def _compute_snapshot(self):
+        with self._lock:
+            total = self.total.copy()
+            isi_n = self.total_isi_n.copy()
+            isi_sum = self.total_isi_sum.copy()
+            isi_sumsq = self.total_isi_sumsq.copy()
+            isi_hist = self.total_isi_hist.copy()
+            counts = self.counts.copy()
+            newest = self._bin
+            span = (0.0 if newest is None else min(self.window, (newest + 1) * self.bin_width - self._t_first))
+            events = self.events
+        span = max(span, self.bin_width)
+        rates = total / span
+        valid_pop = self.population_of >= 0
+        pop_counts = np.bincount(self.population_of[valid_pop], weights=total[valid_pop], minlength=self.n_populations)
+        population_rates = pop_counts / span / np.maximum(self.population_size, 1)
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = isi_sum / isi_n
+            std = np.sqrt(np.maximum(isi_sumsq / isi_n - mean * mean, 0.0))
+            cv = np.where(isi_n >= 2, std / mean, np.nan)
+
+        # Pairwise synchrony: correlation of the binned population counts over the window
+        slots = (np.arange(newest - self.n_bins + 1, newest + 1) % self.n_bins if newest is not None
+                 else np.arange(self.n_bins))
+        binned = counts[slots] @ self._membership
+        with np.errstate(invalid='ignore', divide='ignore'):
+            synchrony = np.corrcoef(binned.T) if self.n_populations > 1 else np.ones((1, 1))
+        synchrony = np.nan_to_num(synchrony)
+        pairs = synchrony[np.triu_indices(self.n_populations, 1)]
+        return {'time': time.time(), 'events': events, 'window': span,
+                'rates': rates, 'population_rates': population_rates, 'cv': cv,
+                'isi_histogram': isi_hist, 'isi_edges': self.isi_edges,
+                'synchrony': synchrony, 'mean_synchrony': float(pairs.mean()) if len(pairs) else 0.0}
+
+    def _snapshot_loop(self):
+        while not self._stop.wait(self.snapshot_period):
+            self.latest = self._compute_snapshot()
+
+    def snapshot(self, fresh=False):
+        ''' Last published snapshot (dict of arrays), or one computed now with fresh=True '''
+        if fresh:
+            self.latest = self._compute_snapshot()
+        return self.latest
+
+    def rates(self, neurons=None):
+        ''' Firing rate (Hz) per neuron id over the window '''
+        rates = self.latest['rates']
+        return rates if neurons is None else rates[np.asarray(neurons)]
+
+    def population_rates(self):
+        ''' Mean firing rate (Hz) per neuron of each population, in the order of self.notes '''
+        return dict(zip(self.notes, self.latest['population_rates'].tolist()))
+
+    def cv(self, neurons=None):
+        ''' ISI coefficient of variation per neuron id (nan with fewer than 2 ISIs in the window) '''
+        cv = self.latest['cv']
+        return cv if neurons is None else cv[np.asarray(neurons)]
+
+    def isi_histogram(self, note=None):
+        ''' (counts, edges) of the ISI histogram of one population (target note), all populations summed if None '''
+        hist = self.latest['isi_histogram']
+        counts = hist.sum(axis=0) if note is None else hist[self.notes.index(note)]
+        return counts, self.latest['isi_edges']
+
+    def synchrony(self):
+        ''' (matrix, mean) pairwise correlation of the population counts, matrix in the order of self.notes '''
+        return self.latest['synchrony'], self.latest['mean_synchrony']
+
+    def cleanup(self):
+        self.running = False
+        self._stop.set()
+        if self.worker is not None:
+            self.worker.join()
@@ -0,0 +1,171 @@
+"""
+Project: Concerto
+Description: Rate-controlled stimulation of hardware neurons. A StimulationPlan gives each target neuron a Poisson or
+            regular spike train at a configured rate; the trains are precomputed one period at a time (seeded, so a
+            run can be reproduced) and merged into a single time-ordered schedule. The Stimulator sends the spikes due
+            at each tick as one batch on a deadline schedule, with a cap per batch so stimulation cannot starve the
+            event readout. Plans can be swapped atomically while running.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import threading
+import time
+import numpy as np
+
+MODES = ('poisson', 'regular')
+
+
+def poisson_spike_train(frequency, duration=1, time_resolution=1e-6, rng=None):
+    '''
+    Spike times (s) in [0, duration) of a Poisson train at frequency Hz, on a time_resolution grid.
+    Same process as poisson_spike_train in Examples/example_texel.py (one Bernoulli draw per time step), drawn as
+    exponential inter-spike intervals so the cost follows the number of spikes instead of duration / time_resolution.
+    '''
+    rng = (rng if rng is not None else np.random.default_rng())
+    if frequency <= 0:
+        return np.empty(0)
+    n = rng.poisson(frequency * duration)
+    times = np.sort(rng.random(n) * duration)
+    times = np.floor(times / time_resolution) * time_resolution
+    return np.unique(times)
+
+
+def regular_spike_train(frequency, start=0.0, duration=1, phase=0.0):
+    ''' Spike times (s) in [start, start + duration) of a train at exactly frequency Hz, first spike at phase '''
+    if frequency <= 0:
+        return np.empty(0)
+    period = 1.0 / frequency
+    first = np.ceil((start - phase) / period)
+    last = np.ceil((start + duration - phase) / period)
+    return phase + np.arange(first, last) * period
+
+
+class StimulationPlan():
+    """
+    Target neurons and their rates. rates is {neuron: Hz}. window(k) returns the merged (times, neurons) schedule of
+    period k, times relative to the start of the stimulation; every period is drawn from its own seeded generator,
+    so the trains are the same whenever (seed, rates) are.
+    """
+    def __init__(self, rates, mode='poisson', period=1.0, seed=None, time_resolution=1e-6):
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {MODES}")
+        self.rates = {int(n): float(r) for n, r in rates.items()}
+        self.mode = mode
+        self.period = period
+        self.seed = (seed if seed is not None else np.random.SeedSequence().entropy)
+        self.time_resolution = time_resolution
+
+    @classmethod
+    def uniform(cls, neuron_list, rate, **kwargs):
+        ''' Same rate for every neuron of neuron_list '''
+        return cls({n: rate for n in neuron_list}, **kwargs)
+
+    def window(self, k):
+        start = k * self.period
+        times, neurons = [], []
+        for i, (neuron, rate) in enumerate(sorted(self.rates.items())):
+            if self.mode == 'poisson':
+                rng = np.random.default_rng([self.seed, k, neuron])
+                train = start + poisson_spike_train(rate, self.period, self.time_resolution, rng)
+            else:
+                # Staggered phases so regular trains of equal rate do not all land on the same tick
+                phase = (i / max(len(self.rates), 1)) / rate if rate > 0 else 0.0
+                train = regular_spike_train(rate, start, self.period, phase)
+            times.append(train)
+            neurons.append(np.full(len(train), neuron, dtype=np.int64))
+        if not times:
+            return np.empty(0), np.empty(0, dtype=np.int64)
+        times = np.concatenate(times)
+        neurons = np.concatenate(neurons)
+        order = np.argsort(times, kind='stable')
+        return times[order], neurons[order]
+
+
+class Stimulator():
+    """
+    Sends the schedule of the current plan through send(neurons), one call per tick with every spike that is due.
+    A tick never sends more than max_batch spikes; the spikes left over are dropped, never sent, and counted in
+    self.dropped, rather than sent in a burst that would hold the serial link. set_plan() swaps the plan on the running schedule: the new
+    plan takes over at the current stimulation time.
+    """
+    def __init__(self, send, tick=0.002, max_batch=64, clock=time.monotonic):
+        self.send = send
+        self.tick = tick
+        self.max_batch = max_batch
+        self.clock = clock
+        self._plan = None
+        self._changed = threading.Event()
+        self.running = False
+        self.worker = None
+        self.sent = 0
+        self.batches = 0
+        self.dropped = 0   # spikes over max_batch, never sent
+
+    def set_plan(self, plan):
+        self._plan = plan
+        self._changed.set()
+
+    def start(self, plan=None):
+        if plan is not None:
+            self._plan = plan
+        if self.worker is not None:
+            return
+        self.running = True
+        self.worker = threading.Thread(target=self._loop, daemon=True)
+        self.worker.start()
+
+    def stop(self):
+        self.running = False
+        self._changed.set()
+        if self.worker is not None:
+            self.worker.join()
+            self.worker = None
+
+    def stats(self):
+        return {'sent': self.sent, 'batches': self.batches, 'dropped': self.dropped}
+
+    def _loop(self):
+        t0 = self.clock()
+        plan, k, times, neurons, i = None, 0, np.empty(0), np.empty(0, dtype=np.int64), 0
+        while self.running:
+            now = self.clock() - t0
+            if self._plan is not plan:
+                # Plan swapped: continue on the same timeline from the current period of the new plan
+                plan = self._plan
+                if plan is not None:
+                    k = int(now // plan.period)
+                    times, neurons = plan.window(k)
+                    i = int(np.searchsorted(times, now, side='left'))
+            if plan is None:
+                self._changed.wait()
+                self._changed.clear()
+                continue
+            if i == len(times):
+                end = (k + 1) * plan.period
+                if now < end:
+                    if self._changed.wait(end - now):
+                        self._changed.clear()
+                    continue
+                k += 1
+                times, neurons = plan.window(k)
+                i = 0
+                continue
+            j = int(np.searchsorted(times, now, side='right'))
+            if j > i:
+                due = neurons[i:j]
+                if len(due) > self.max_batch:
+                    self.dropped += len(due) - self.max_batch
+                    due = due[-self.max_batch:]
+                self.send(due)
+                self.sent += len(due)
+                self.batches += 1
+                i = j
+                continue
+            # Sleep until the next spike is due, but never less than a tick so spikes are sent in batches
+            wait = max(times[i] - now, self.tick)
+            if self._changed.wait(wait):
+                self._changed.clear()
@@ -0,0 +1,169 @@
+"""
+Project: Concerto
+Description: Mirror of the bias, synapse weight and monitor state of a Texel chip. Updates are diffed against the
+            mirror and only the values that changed reach the chip; many bias changes at once go out as a single
+            write_all_registers() of the parameter table instead of one update_parameter round trip each.
+            The mirror is persisted so a new session can skip the full chip reset when nothing changed (warm start).
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import hashlib
+import json
+import os
+import threading
+
+
+def _fingerprint(parameters, flags):
+    ''' Identifies the parameter table and flags the chip was reset with '''
+    table = [(p.get('name'), p.get('par'), p.get('type')) for p in parameters]
+    flag_values = [(f.get('name'), f.get('value')) for f in (flags or [])]
+    return hashlib.sha1(json.dumps([table, flag_values]).encode()).hexdigest()
+
+
+class TexelParameterCache():
+    """
+    parameters is the table handed to texel_interface (texel_params.parameters): the chip is in that state right
+    after clean(). Core 0 bias changes are also written into that table, so write_all_registers() always sends
+    the mirrored state. Weights missing from the mirror are 0 (synapses are reset by clean()).
+    Updates only change the mirror; the owner persists it with save(), or with snapshot() under its chip lock
+    and write() once the lock is released, so the serial link never waits on the disk.
+    """
+    def __init__(self, parameters, flags=None, path=None, bulk_threshold=8):
+        self.table = parameters
+        self.path = path
+        self.bulk_threshold = bulk_threshold
+        self.flags = flags
+        self.fingerprint = _fingerprint(parameters, flags)
+        self.biases = {}
+        self.weights = {}
+        self.monitors = set()
+        self.synced = False
+        self.round_trips = 0
+        self._version = 0     # bumped by every mirror change, snapshots older than the file are not written
+        self._written = -1
+        self._write_lock = threading.Lock()
+        self._from_table()
+        self._table_names = set(self.biases)
+
+    def _from_table(self):
+        self.biases = {(0, p['name']): p['par'] for p in self.table if p.get('name') != 'void'}
+
+    def _to_table(self, core, values):
+        if core != 0:
+            return
+        for p in self.table:
+            if p.get('name') in values:
+                p['par'] = values[p['name']]
+
+    def reset(self):
+        ''' The chip was reset and written from the table: the mirror is exact again '''
+        self._from_table()
+        self.weights = {}
+        self.monitors = set()
+        self.synced = True
+        self._version += 1
+        self.save()
+
+    def invalidate(self):
+        ''' Chip state unknown (power cycle, manual reset): next start does a full reset '''
+        self.synced = False
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def load(self):
+        ''' Restore the mirror of the last session, True when it applies to this table and flags '''
+        if not self.path or not os.path.exists(self.path):
+            return False
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return False
+        # Either the table this session started from or the table as left by the last session (same process)
+        if self.fingerprint not in (state.get('fingerprint'), state.get('table')):
+            return False
+        self.biases = {(int(core), name): value for core, name, value in state['biases']}
+        self.weights = {(core, neuron, synapse): value for core, neuron, synapse, value in state['weights']}
+        self.monitors = {(core, kind, neuron) for core, kind, neuron in state['monitors']}
+        self._to_table(0, {name: value for (core, name), value in self.biases.items() if core == 0})
+        self.synced = True
+        return True
+
+    def snapshot(self):
+        ''' (version, state) of the mirror, cheap: take it where the mirror is updated '''
+        state = {'fingerprint': self.fingerprint, 'table': _fingerprint(self.table, self.flags),
+                 'biases': [[core, name, value] for (core, name), value in self.biases.items()],
+                 'weights': [[*key, value] for key, value in self.weights.items()],
+                 'monitors': [list(key) for key in self.monitors]}
+        return self._version, state
+
+    def write(self, snapshot):
+        ''' Persist a snapshot, unless a newer one was written already '''
+        if not self.path:
+            return
+        version, state = snapshot
+        with self._write_lock:
+            if version <= self._written:
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp, self.path)
+            self._written = version
+
+    def save(self):
+        if self.path:
+            self.write(self.snapshot())
+
+    def update_parameters(self, chip, values, core=0):
+        ''' Send the biases of {name: value} that differ from the mirror, returns how many changed '''
+        changed = {name: value for name, value in values.items() if self.biases.get((core, name)) != value}
+        if not changed:
+            return 0
+        self._to_table(core, changed)
+        single = changed
+        if core == 0:
+            in_table = {name for name in changed if (0, name) in self._table_names}
+            if len(in_table) >= self.bulk_threshold:
+                chip.write_all_registers()
+                self.round_trips += 1
+                single = {name: value for name, value in changed.items() if name not in in_table}
+        for name, value in single.items():
+            chip.update_parameter(core=core, param=name, value=value)
+        self.round_trips += len(single)
+        for name, value in changed.items():
+            self.biases[(core, name)] = value
+        self._version += 1
+        return len(changed)
+
+    def set_weights(self, chip, weights, core=0, synapse_idx=0):
+        ''' Send the synapse weights of {neuron: value} that differ from the mirror, returns how many changed '''
+        changed = {n: v for n, v in weights.items() if self.weights.get((core, n, synapse_idx), 0) != v}
+        for neuron, value in changed.items():
+            chip.set_synapse_weight(core=core, neuron_idx=neuron, synapse_idx=(synapse_idx), value=value)
+            self.weights[(core, neuron, synapse_idx)] = value
+        self.round_trips += len(changed)
+        if changed:
+            self._version += 1
+        return len(changed)
+
+    def activate_monitors(self, chip, neuron_list, core=0, synapse_idx=0):
+        ''' Neuron and synapse monitors of neuron_list, only the ones not active yet '''
+        added = 0
+        for n in neuron_list:
+            if (core, 'neuron', n) not in self.monitors:
+                chip.activate_neuron_monitor(core=core, neuron_idx=n)
+                self.monitors.add((core, 'neuron', n))
+                added += 1
+            if (core, 'synapse', n) not in self.monitors:
+                chip.activate_synapse_monitor(core=core, neuron_idx=n, synapse_idx=synapse_idx)
+                self.monitors.add((core, 'synapse', n))
+                added += 1
+        self.round_trips += added
+        if added:
+            self._version += 1
+        return added
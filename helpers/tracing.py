@@ -0,0 +1,96 @@
+"""
+Project: Concerto
+Description: Opt-in pipeline tracing. A Tracer keeps complete spans (name, thread, start, duration, args) of the
+            listener/generator threads in a bounded ring and exports them as Chrome trace-event JSON, to open in
+            chrome://tracing or https://ui.perfetto.dev. Hooked spans:
+                notify, update:<Observer class>   Subject.notify / notify_batch and each observer update
+                read                              hardware reads (Texel, DYNAP-SE)
+                stimulate                         Texel stimulation bursts on the serial link
+                flush, midi_send                  generator ticks (args: wake lateness) and sink sends
+
+                tracer = Tracer(sample=0.1)
+                tracer.instrument(listener, generator)
+                ...
+                tracer.export_chrome('trace.json')
+
+            sample < 1 traces that fraction of the notify calls / reads / ticks (a sampled notify keeps all its
+            nested spans), capacity bounds memory in long runs: the oldest spans are overwritten.
+
+Code owner: Alejandro Pequeno-Zurro, https://github.com/alpeq/Concerto
+
+Contributors: Adrian Whatley, Mirco Tincani
+
+License MIT
+"""
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+class Tracer():
+    def __init__(self, capacity=1 << 16, sample=1.0, seed=None):
+        self.sample = sample
+        self.spans = deque(maxlen=capacity)   # appends are atomic, the oldest span falls out when full
+        self.recorded = 0
+        self._random = random.Random(seed).random
+        self._threads = {}
+        self._origin = time.perf_counter_ns()
+
+    def sampled(self):
+        ''' Whether to trace this root operation '''
+        return self.sample >= 1.0 or self._random() < self.sample
+
+    def now(self):
+        return time.perf_counter_ns()
+
+    def record(self, name, start_ns, end_ns=None, **args):
+        ''' Complete span from start_ns to end_ns (now when None), perf_counter_ns clock '''
+        if end_ns is None:
+            end_ns = time.perf_counter_ns()
+        tid = threading.get_ident()
+        if tid not in self._threads:
+            self._threads[tid] = threading.current_thread().name
+        self.spans.append((name, tid, start_ns, end_ns - start_ns, args or None))
+        self.recorded += 1
+
+    @contextmanager
+    def span(self, name, **args):
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.record(name, start, **args)
+
+    def instrument(self, *objects):
+        ''' Enable tracing on subjects, generators and listeners (anything with a tracer attribute) '''
+        for obj in objects:
+            obj.tracer = self
+            for shard in getattr(obj, 'shards', ()):
+                shard.tracer = self
+
+    def clear(self):
+        self.spans.clear()
+        self.recorded = 0
+
+    def events(self):
+        ''' Chrome trace events: one complete ('X') event per span plus thread name metadata, times in us '''
+        pid = os.getpid()
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': tid, 'args': {'name': name}}
+                  for tid, name in list(self._threads.items())]
+        for name, tid, start, duration, args in list(self.spans):
+            event = {'name': name, 'cat': name.split(':')[0], 'ph': 'X', 'pid': pid, 'tid': tid,
+                     'ts': (start - self._origin) / 1e3, 'dur': duration / 1e3}
+            if args:
+                event['args'] = args
+            events.append(event)
+        return events
+
+    def export_chrome(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.events(), 'displayTimeUnit': 'ms',
+                       'otherData': {'recorded': self.recorded, 'kept': len(self.spans), 'sample': self.sample}}, f)
+        return path